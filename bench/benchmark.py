@@ -0,0 +1,575 @@
+"""
+AWS resource benchmarks
+
+Times the hot paths (fetching, lookups, printing, JSON output and secret
+CRUD) against a local stand-in for the EC2 and Secrets Manager APIs, so it
+runs offline and needs no AWS account. The stand-in serves a synthetic
+account of the requested size (vpcs, subnets and secrets) from its own
+process. Each scenario runs in a fresh process, through the same botocore
+stack the commands use, and reports throughput, latency percentiles, peak
+RSS and the API calls it made.
+
+usage:
+
+    clam-py $CLAMITY_ROOT/bench/benchmark.py [--size 10000] [--scenarios vpcs.fetch,secrets.get,...]
+                                             [--save results.json] [--compare baseline.json [--tolerance 0.25]]
+
+Use --compare with the results of an earlier --save to fail (exit 1) when a
+scenario's throughput drops by more than the tolerance.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import zlib
+import subprocess
+import http.server
+from urllib.parse import parse_qs
+
+_script = os.path.abspath(__file__)  # scenarios and the stand-in run in their own processes
+_accountId = "123456789012"
+_region = "us-east-1"
+
+# ---------------------------------------------------------------------------------------------
+# The stand-in. Resources are generated from their index when a page is served so large
+# accounts don't need the memory to hold them.
+
+
+def _vpcXml(i: int) -> str:
+    return (
+        f"<item><vpcId>vpc-{i:017x}</vpcId><state>available</state>"
+        f"<cidrBlock>10.{i // 256 % 256}.{i % 256}.0/24</cidrBlock><isDefault>false</isDefault>"
+        f"<tagSet><item><key>Name</key><value>bench-vpc-{i:07d}</value></item></tagSet></item>"
+    )
+
+
+def _subnetXml(i: int) -> str:
+    return (
+        f"<item><subnetId>subnet-{i:017x}</subnetId><vpcId>vpc-{i // 10:017x}</vpcId><state>available</state>"
+        f"<cidrBlock>10.{i // 256 % 256}.{i % 256}.0/28</cidrBlock><availabilityZone>{_region}a</availabilityZone>"
+        f"<tagSet><item><key>Name</key><value>bench-subnet-{i:07d}</value></item></tagSet></item>"
+    )
+
+
+_ec2Collections = {  # action => (response set element, item renderer)
+    "DescribeVpcs": ("vpcSet", _vpcXml),
+    "DescribeSubnets": ("subnetSet", _subnetXml),
+}
+
+
+def _secretName(i: int) -> str:
+    return f"bench/app{i % 100:02d}/secret{i:07d}"
+
+
+def _secretArn(name: str) -> str:
+    return f"arn:aws:secretsmanager:{_region}:{_accountId}:secret:{name}-{zlib.crc32(name.encode()) % 16**6:06x}"
+
+
+class _secretStore:
+    """synthetic secrets plus whatever the benchmark creates, updates and deletes"""
+
+    def __init__(self, size: int) -> None:
+        self._size = size
+        self._created = {}  # name => record
+        self._updated = {}  # name => record
+        self._deleted = set()
+
+    def _synthetic(self, name: str) -> dict:
+        m = re.fullmatch(r"bench/app\d\d/secret(\d{7})", name)
+        if not m or int(m.group(1)) >= self._size:
+            return None
+        i = int(m.group(1))
+        return {"Name": name, "Description": f"secret {i}", "SecretString": json.dumps({"password": f"pw{i}"}), "Version": 1}
+
+    def get(self, secretId: str, includeDeleted: bool = False) -> dict:
+        name = secretId.split(":secret:", 1)[1][:-7] if secretId.startswith("arn:") else secretId
+        if name in self._deleted and not includeDeleted:
+            return None
+        return self._updated.get(name) or self._created.get(name) or self._synthetic(name)
+
+    def page(self, prefix: str, start: int, n: int) -> tuple:
+        """up to n names from position start (synthetic secrets, then created ones). Returns (names, next position)."""
+        created = list(self._created)
+        names = []
+        pos = start
+        while len(names) < n and pos < self._size + len(created):
+            name = _secretName(pos) if pos < self._size else created[pos - self._size]
+            if name.startswith(prefix) and name not in self._deleted:
+                names.append(name)
+            pos += 1
+        return names, (pos if pos < self._size + len(created) else None)
+
+    def put(self, name: str, record: dict, created: bool = False) -> None:
+        (self._created if created else self._updated)[name] = record
+        self._deleted.discard(name)
+
+    def delete(self, name: str) -> None:
+        self._deleted.add(name)
+
+    def restore(self, name: str) -> None:
+        self._deleted.discard(name)
+
+
+class _standInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as with AWS
+    wbufsize = 65536  # send headers and body together
+    disable_nagle_algorithm = True
+    size = 0
+    pageSize = 1000
+    secrets = None
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: str, contentType: str) -> None:
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        target = self.headers.get("X-Amz-Target")
+        if target:
+            self._secretsManager(target.split(".")[-1], json.loads(body or b"{}"))
+        else:
+            self._ec2({k: v[0] for k, v in parse_qs(body.decode()).items()})
+
+    def _ec2(self, params: dict) -> None:
+        action = params.get("Action")
+        if action not in _ec2Collections:
+            err = f"<Code>InvalidAction</Code><Message>{action} is not supported by the stand-in</Message>"
+            self._reply(400, f"<Response><Errors><Error>{err}</Error></Errors></Response>", "text/xml")
+            return
+        setName, render = _ec2Collections[action]
+        start = int(params.get("NextToken") or 0)
+        end = min(self.size, start + int(params.get("MaxResults") or self.pageSize))
+        items = "".join(render(i) for i in range(start, end))
+        nextToken = f"<nextToken>{end}</nextToken>" if end < self.size else ""
+        body = f"<requestId>0</requestId><{setName}>{items}</{setName}>{nextToken}"
+        self._reply(
+            200, f'<{action}Response xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">{body}</{action}Response>', "text/xml"
+        )
+
+    def _notFound(self, secretId: str) -> None:
+        msg = {"__type": "ResourceNotFoundException", "Message": f"Secrets Manager can't find {secretId}"}
+        self._reply(400, json.dumps(msg), "application/x-amz-json-1.1")
+
+    @staticmethod
+    def _value(s: dict) -> dict:
+        return {
+            "ARN": _secretArn(s["Name"]),
+            "Name": s["Name"],
+            "VersionId": f"v{s['Version']:08d}",
+            "SecretString": s["SecretString"],
+            "VersionStages": ["AWSCURRENT"],
+            "CreatedDate": 1700000000,
+        }
+
+    @staticmethod
+    def _describe(s: dict) -> dict:
+        return {
+            "ARN": _secretArn(s["Name"]),
+            "Name": s["Name"],
+            "Description": s["Description"],
+            "LastChangedDate": 1700000000 + s["Version"],
+            "Tags": [{"Key": "Name", "Value": s["Name"]}],
+        }
+
+    def _listSecrets(self, req: dict) -> dict:
+        prefix = next((f["Values"][0] for f in req.get("Filters", []) if f["Key"] == "name"), "")
+        names, nextPos = self.secrets.page(prefix, int(req.get("NextToken") or 0), int(req.get("MaxResults") or 100))
+        response = {"SecretList": [self._describe(self.secrets.get(n)) for n in names]}
+        if nextPos is not None:
+            response["NextToken"] = str(nextPos)
+        return response
+
+    def _batchGetSecretValue(self, req: dict) -> dict:
+        if "SecretIdList" in req:
+            found = [(i, self.secrets.get(i)) for i in req["SecretIdList"]]
+            return {
+                "SecretValues": [self._value(s) for _, s in found if s],
+                "Errors": [{"SecretId": i, "ErrorCode": "ResourceNotFoundException"} for i, s in found if not s],
+            }
+        listed = self._listSecrets({**req, "MaxResults": req.get("MaxResults") or 20})
+        return {
+            "SecretValues": [self._value(self.secrets.get(s["Name"])) for s in listed["SecretList"]],
+            **({"NextToken": listed["NextToken"]} if "NextToken" in listed else {}),
+        }
+
+    def _secretsManager(self, operation: str, req: dict) -> None:  # noqa: C901
+        secretId = req.get("SecretId") or req.get("Name")
+        match operation:
+            case "ListSecrets":
+                response = self._listSecrets(req)
+            case "BatchGetSecretValue":
+                response = self._batchGetSecretValue(req)
+            case "DescribeSecret" | "GetSecretValue" | "PutSecretValue" | "UpdateSecret" | "DeleteSecret":
+                s = self.secrets.get(secretId)
+                if not s:
+                    return self._notFound(secretId)
+                if operation == "DescribeSecret":
+                    response = self._describe(s)
+                elif operation == "GetSecretValue":
+                    response = self._value(s)
+                elif operation == "DeleteSecret":
+                    self.secrets.delete(s["Name"])
+                    response = {"ARN": _secretArn(s["Name"]), "Name": s["Name"], "DeletionDate": time.time() + 7 * 86400}
+                else:
+                    s = {**s, "Version": s["Version"] + 1}
+                    s["SecretString"] = req.get("SecretString", s["SecretString"])
+                    s["Description"] = req.get("Description", s["Description"])
+                    self.secrets.put(s["Name"], s)
+                    response = {"ARN": _secretArn(s["Name"]), "Name": s["Name"], "VersionId": f"v{s['Version']:08d}"}
+            case "CreateSecret":
+                s = {"Name": secretId, "Description": req.get("Description", ""), "SecretString": req["SecretString"]}
+                self.secrets.put(secretId, {**s, "Version": 1}, created=True)
+                response = {"ARN": _secretArn(secretId), "Name": secretId, "VersionId": f"v{1:08d}"}
+            case "RestoreSecret":
+                s = self.secrets.get(secretId, includeDeleted=True)
+                if not s:
+                    return self._notFound(secretId)
+                self.secrets.restore(s["Name"])
+                response = {"ARN": _secretArn(s["Name"]), "Name": s["Name"]}
+            case _:
+                msg = {"__type": "InvalidRequestException", "Message": f"{operation} is not supported by the stand-in"}
+                return self._reply(400, json.dumps(msg), "application/x-amz-json-1.1")
+        self._reply(200, json.dumps(response), "application/x-amz-json-1.1")
+
+
+def serve(size: int, pageSize: int) -> None:
+    """run the stand-in, printing the port it's listening on"""
+    _standInHandler.size = size
+    _standInHandler.pageSize = pageSize
+    _standInHandler.secrets = _secretStore(size)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _standInHandler)
+    server.daemon_threads = True
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+# ---------------------------------------------------------------------------------------------
+# Scenarios. Each returns a list of (seconds, items) samples.
+
+
+def _timed(fn, *args) -> tuple:
+    started = time.perf_counter()
+    items = fn(*args)
+    return (time.perf_counter() - started, items)
+
+
+def _fetched(resourcesClass):
+    collection = resourcesClass().fetch()
+    len(collection)  # consume the pages
+    return collection
+
+
+def _fetchScenario(resourcesClass, projected: bool = False):
+    def run(args) -> list:
+        return [_timed(lambda: len(resourcesClass().fetch(projected=projected))) for _ in range(args.repeat)]
+
+    return run
+
+
+def _lookupScenario(resourcesClass, method: str, key):
+    def run(args) -> list:
+        collection = _fetched(resourcesClass)
+        items = list(collection)
+        picks = [key(random.choice(items)) for _ in range(args.lookups)]
+        finder = getattr(collection, method)
+        return [_timed(lambda k: 1 if finder(k) else 0, k) for k in picks]
+
+    return run
+
+
+def _printScenario(resourcesClass, outputFormat: str):
+    def run(args) -> list:
+        import clamity.core.options as cOptions
+
+        collection = _fetched(resourcesClass)
+        output = cOptions.outputFormat[outputFormat.upper()]
+        return [_timed(lambda: collection.print(output=output) or len(collection)) for _ in range(args.repeat)]
+
+    return run
+
+
+def _dumpJsonScenario(args) -> list:
+    import clamity.core.utils as cUtils
+    from clamity.aws import resources
+
+    data = [r._describeData for r in _fetched(resources.vpcs)]
+    with open(os.devnull, "w") as devNull:
+        return [_timed(lambda: cUtils.dumpJson(data, outputStream=devNull) or len(data)) for _ in range(args.repeat)]
+
+
+def _dumpObjScenario(args) -> list:
+    """serializing fetched secrets must not make any API calls"""
+    import clamity.core.utils as cUtils
+    from clamity.aws import resources
+
+    collection = _fetched(resources.secrets)
+    with open(os.devnull, "w") as devNull:
+        return [
+            _timed(lambda: sum(cUtils.dumpObj(r, outputStream=devNull) or 1 for r in collection)) for _ in range(args.repeat)
+        ]
+
+
+def _secretsGetScenario(args) -> list:
+    from clamity.aws import resources
+
+    names = [_secretName(random.randrange(args.size)) for _ in range(args.lookups)]
+    return [_timed(lambda n: 1 if resources.secrets().get(n).value else 0, n) for n in names]
+
+
+def _secretsReadValuesScenario(args) -> list:
+    from clamity.aws import resources
+
+    batch = min(100, args.size)
+    samples = []
+    for _ in range(args.repeat):
+        names = [_secretName(i) for i in random.sample(range(args.size), batch)]
+        samples.append(_timed(lambda: len(resources.secrets().readValues(names))))
+    return samples
+
+
+def _secretsCrudScenario(args) -> list:
+    """create, update, delete and restore a secret"""
+    from clamity.aws import resources
+
+    def cycle(i: int) -> int:
+        name = f"bench/crud/secret{i:07d}"
+        props = {"name": name, "desc": "benchmark", "value": f"v{i}", "type": resources.secretType.SIMPLE}
+        resources.resourceFactory.new(resources.resourceType.SECRET, props=props).create()
+        resources.secrets().get(name).update(value=f"v{i}-2", desc="updated")
+        resources.secrets().get(name).destroy()
+        resources.secret().restore(name)
+        return 1
+
+    return [_timed(cycle, i) for i in range(max(1, args.lookups // 10))]
+
+
+def _scenarios() -> dict:
+    from clamity.aws import resources
+
+    return {
+        "vpcs.fetch": _fetchScenario(resources.vpcs),
+        "vpcs.fetch.projected": _fetchScenario(resources.vpcs, projected=True),
+        "subnets.fetch": _fetchScenario(resources.subnets),
+        "vpcs.findOne.name": _lookupScenario(resources.vpcs, "findOne", lambda r: r.name),
+        "vpcs.findOne.id": _lookupScenario(resources.vpcs, "findOne", lambda r: r.id),
+        "vpcs.findByPrefix": _lookupScenario(resources.vpcs, "findByPrefix", lambda r: r.name[:-2]),
+        "vpcs.print.text": _printScenario(resources.vpcs, "text"),
+        "vpcs.print.json": _printScenario(resources.vpcs, "json"),
+        "vpcs.print.ndjson": _printScenario(resources.vpcs, "ndjson"),
+        "vpcs.print.csv": _printScenario(resources.vpcs, "csv"),
+        "dumpJson": _dumpJsonScenario,
+        "secrets.dumpObj": _dumpObjScenario,
+        "secrets.fetch": _fetchScenario(resources.secrets),
+        "secrets.fetch.projected": _fetchScenario(resources.secrets, projected=True),
+        "secrets.get": _secretsGetScenario,
+        "secrets.readValues": _secretsReadValuesScenario,
+        "secrets.crud": _secretsCrudScenario,
+    }
+
+
+def _percentile(sortedValues: list, p: float) -> float:
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(len(sortedValues) - 1, int(round(p / 100 * (len(sortedValues) - 1))))]
+
+
+def _peakRssMB() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KB elsewhere
+
+
+def runScenario(name: str, args) -> dict:
+    """run one scenario in this process (output is discarded) and summarize it"""
+    import clamity.core.options as cOptions
+    from clamity.aws import session
+
+    if not args.rate_limit:
+        session._serviceRates = {}
+        session._defaultRate = (1e9, 10**9)
+    sys.argv = ["benchmark", "--no-cache", "--aws-region", _region, "--no-header"]
+    options = cOptions.CmdOptions().parser()
+    options.add_args(["common", "aws"])
+    options.parse()
+    scenario = _scenarios()[name]
+    baseRss = _peakRssMB()
+    random.seed(args.seed)
+    samples = scenario(args)
+    durations = sorted(d for d, _ in samples)
+    total = sum(durations)
+    items = sum(n for _, n in samples)
+    stats = session.sessionSettings().callStats.values()
+    return {
+        "scenario": name,
+        "size": args.size,
+        "samples": len(samples),
+        "items": items,
+        "seconds": total,
+        "itemsPerSec": items / total if total else 0.0,
+        "p50ms": _percentile(durations, 50) * 1000,
+        "p90ms": _percentile(durations, 90) * 1000,
+        "p99ms": _percentile(durations, 99) * 1000,
+        "baseRssMB": baseRss,
+        "peakRssMB": _peakRssMB(),
+        "apiCalls": sum(s["calls"] for s in stats),
+        "apiRequests": sum(s["requests"] for s in stats),
+        "throttles": sum(s["throttles"] for s in stats),
+    }
+
+
+def _runWorker(name: str, args, endpoint: str) -> dict:
+    """run a scenario in a new process pointed at the stand-in"""
+    with tempfile.TemporaryDirectory() as home:
+        env = {
+            **os.environ,
+            "CLAMITY_HOME": home,
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_DEFAULT_REGION": _region,
+            "AWS_ENDPOINT_URL_EC2": endpoint,
+            "AWS_ENDPOINT_URL_SECRETS_MANAGER": endpoint,
+        }
+        for var in ["AWS_PROFILE", "AWS_SESSION_TOKEN", "CLAMITY_TRACE"]:
+            env.pop(var, None)
+        resultFile = os.path.join(home, "result.json")
+        cmd = [sys.executable, _script, "--worker", name, "--result-file", resultFile]
+        cmd += ["--size", str(args.size), "--repeat", str(args.repeat), "--lookups", str(args.lookups)]
+        cmd += ["--seed", str(args.seed)] + (["--rate-limit"] if args.rate_limit else [])
+        output = None if args.verbose else subprocess.DEVNULL
+        if subprocess.run(cmd, env=env, stdout=output, stderr=output).returncode != 0 or not os.path.exists(resultFile):
+            print(f"{name}: failed (run with --verbose for details)", file=sys.stderr)
+            return None
+        with open(resultFile) as f:
+            return json.load(f)
+
+
+def _printResults(results: list) -> None:
+    fmt = "{:<24} {:>8} {:>9} {:>12} {:>9} {:>9} {:>9} {:>9} {:>8} {:>9}"
+    print(
+        fmt.format(
+            "Scenario", "Samples", "Items", "Items/sec", "p50 ms", "p90 ms", "p99 ms", "Peak MB", "API calls", "Requests"
+        )
+    )
+    for r in results:
+        print(
+            fmt.format(
+                r["scenario"],
+                r["samples"],
+                r["items"],
+                f"{r['itemsPerSec']:.1f}",
+                f"{r['p50ms']:.3f}",
+                f"{r['p90ms']:.3f}",
+                f"{r['p99ms']:.3f}",
+                f"{r['peakRssMB']:.1f}",
+                r["apiCalls"],
+                r["apiRequests"],
+            )
+        )
+
+
+def _regressions(results: list, baselineFile: str, tolerance: float) -> list:
+    with open(baselineFile) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    slower = []
+    for r in results:
+        b = baseline.get(r["scenario"])
+        if b and b["size"] == r["size"] and r["itemsPerSec"] < b["itemsPerSec"] * (1 - tolerance):
+            slower.append(f"{r['scenario']}: {r['itemsPerSec']:.1f} items/sec vs {b['itemsPerSec']:.1f} in {baselineFile}")
+    return slower
+
+
+def _runScenarios(names: list, args) -> list:
+    """start the stand-in and run each scenario against it. None if any fail."""
+    standIn = subprocess.Popen(
+        [
+            sys.executable,
+            _script,
+            "--serve",
+            "--size",
+            str(args.size),
+            "--page-size",
+            str(args.page_size),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        endpoint = f"http://127.0.0.1:{standIn.stdout.readline().strip()}"
+        results = []
+        for name in names:
+            r = _runWorker(name, args, endpoint)
+            if r is None:
+                return None
+            results.append(r)
+            if args.json:
+                print(json.dumps(r), flush=True)
+        return results
+    finally:
+        standIn.terminate()
+        standIn.wait()
+
+
+def main() -> int:
+    scenarioNames = list(_scenarios())
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--size", type=int, default=10000, help="number of vpcs, subnets and secrets in the account")
+    parser.add_argument("--scenarios", type=str, help=f"comma separated list of: {', '.join(scenarioNames)}")
+    parser.add_argument("--repeat", type=int, default=3, help="iterations of bulk scenarios (fetch, print, ...)")
+    parser.add_argument("--lookups", type=int, default=200, help="iterations of per-item scenarios (findOne, get, ...)")
+    parser.add_argument("--page-size", type=int, default=1000, help="EC2 results per page")
+    parser.add_argument("--rate-limit", action="store_true", default=False, help="keep the client side rate limits")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", type=str, help="write the results to this file")
+    parser.add_argument("--compare", type=str, help="exit 1 if throughput regressed against these saved results")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed throughput drop for --compare (0.25)")
+    parser.add_argument("--json", action="store_true", default=False, help="print results as JSON lines")
+    parser.add_argument("--verbose", action="store_true", default=False, help="show the scenarios' output")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.size, args.page_size)
+        return 0
+    if args.worker:
+        result = runScenario(args.worker, args)
+        with open(args.result_file, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    names = [s.strip() for s in args.scenarios.split(",")] if args.scenarios else scenarioNames
+    unknown = [n for n in names if n not in scenarioNames]
+    if unknown:
+        print(f"unknown scenario(s): {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    results = _runScenarios(names, args)
+    if results is None:
+        return 1
+    if not args.json:
+        _printResults(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"created": time.time(), "results": results}, f, indent=4)
+    if args.compare:
+        slower = _regressions(results, args.compare, args.tolerance)
+        for s in slower:
+            print(f"regression: {s}", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -22,7 +22,8 @@ from clamity import aws
 
 Usage = """
     clamity show help
-    clamity show { secret | subnet | vpc | route-table | igw | natgw | eip | sg }
+    clamity show { secret | subnet | vpc | route-table | igw | natgw | eip | sg } [--filter key=value ...]
+                 [--watch [seconds]]
 """
 
 ActionsAndSupplemental = """
@@ -31,7 +32,11 @@ resources:
     AWS resource
 
 examples:
-    Need some examples here.
+    clamity aws show subnet --filter vpc-id=vpc-0123456789abcdef0
+    clamity aws show sg --filter name=web- --filter tag:Env=prod
+    clamity aws show secret --filter name=services/foo/prod/
+    clamity aws show natgw --watch 5
+    clamity aws show vpc --aws-profile all --aws-region all
 """
 
 options = CmdOptions().parser(description=__doc__, usage=Usage, epilog=ActionsAndSupplemental)
@@ -41,6 +46,22 @@ options.add_argument(
     choices=["help", "secret", "vpc", "subnet", "route-table", "igw", "natgw", "eip", "sg"],
     help="resource to list",
 )
+options.add_argument(
+    "--filter",
+    type=str,
+    action="append",
+    help="server side filter: key=value[,value...] (repeatable)\n"
+    "keys: id, name (prefix), vpc-id, tag:<key> or a native describe filter name",
+)
+options.add_argument(
+    "--watch",
+    type=float,
+    nargs="?",
+    const=10,
+    metavar="SECONDS",
+    help="keep polling (default every 10 seconds) and print resources as they're added (+), removed (-)\n"
+    "or changed (~). Polling slows down while nothing changes.",
+)
 
 if len(sys.argv) == 1:
     options.print_usage()
@@ -62,6 +83,14 @@ resourceMap = {
     "eip": aws.resources.eips,
     "sg": aws.resources.security_groups,
 }
-resourceMap[opts.resource]().fetch().print()
+if opts.watch is not None and opts.watch <= 0:
+    print("--watch interval must be greater than 0", file=sys.stderr)
+    exit(1)
+
+resources = resourceMap[opts.resource]()
+if opts.watch:
+    resources.watch(opts.watch, filter=aws.resources.parseFilterArgs(opts.filter), projected=True)
+else:
+    resources.fetch(filter=aws.resources.parseFilterArgs(opts.filter), projected=True).print()
 
 exit(0)
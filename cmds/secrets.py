@@ -15,6 +15,7 @@ synopsis:
 
 import sys
 import os
+import re
 import json
 from clamity.core.options import CmdOptions
 import clamity.core.utils as cUtils
@@ -26,17 +27,20 @@ Usage = """
     clamity secrets write --name secret/path/and/name --desc "useful desc" \\
                           --type <known-type> --value '{"prop1": "val", "prop2": "val2", ...}'
     clamity secrets { read | details | delete } --name secret/path/and/name
+    clamity secrets read { --name secret/path/a --name secret/path/b ... | --prefix secret/path/ } [--emit <fmt>]
     clamity secrets update --name secret/path/and/name [--desc "updated desc"] [[--type <known-type>] --value "secret-data"]
+    clamity secrets agent [ start | stop | status | run ] [--agent-ttl <secs>] [--agent-max-entries <n>]
 """
 
 ActionsAndSupplemental = """
 actions:
 
+    agent    Start, stop or query the secrets agent ('run' stays in the foreground)
     delete   Delete secrets from the secrets store
     details  Display the AWS API response (in JSON) for secret details
     help     Full help
     list     List the secrets
-    read     Return the value of a secret
+    read     Return the value of a secret (or many, with multiple --name's or --prefix)
     update   Update a secret's description or value
     write    Add new secrets to the secrets store
 
@@ -67,6 +71,16 @@ standard storage conventions:
     Individual users' ssh keys:
         users/<aws-user-id>/ssh-keys/<keyName>/{public|private}
 
+secrets agent:
+
+    Like ssh-agent, the secrets agent holds secret values in memory for a short
+    time (--agent-ttl) and serves them over a unix socket only you can access
+    ($CLAMITY_HOME/run/secrets-agent.<aws-profile>.sock or
+    $CLAMITY_SECRETS_AGENT_SOCK). 'read' and 'details' use it automatically
+    when it's running (disable with --no-agent). 'write', 'update', 'delete'
+    and 'restore' remove the secret from a running agent's cache, with or
+    without --no-agent.
+
 examples:
     Need some examples here.
 """
@@ -90,28 +104,119 @@ def print_secret_value(value: str) -> None:
         print(value)
 
 
+def agent_request(op: str, **kwargs) -> dict | None:
+    """send a read request to the secrets agent. None if it's not running or disabled (--no-agent)."""
+    if opts.no_agent:
+        return None
+    response = aws.agent.agentClient(profile=profile).request(op, region=opts.aws_region, **kwargs)
+    if response is not None and not response.get("ok"):
+        print(f"secrets agent: {response.get('error')}", file=sys.stderr)
+        exit(1)
+    return response
+
+
+def agent_invalidate(name: str) -> None:
+    """drop a changed secret from a running agent's cache (even with --no-agent, which only affects reads)"""
+    response = aws.agent.agentClient(profile=profile).request("invalidate", name=name)
+    if response is not None and not response.get("ok"):
+        print(f"warn: secrets agent: {response.get('error')}", file=sys.stderr)
+
+
+def run_agent(cmd: str) -> int:
+    client = aws.agent.agentClient(profile=profile)
+    if not client.path:
+        print("CLAMITY_HOME or CLAMITY_SECRETS_AGENT_SOCK must be set to run the agent", file=sys.stderr)
+        return 1
+    match cmd:
+        case "status":
+            status = client.request("status")
+            if status is None:
+                print("secrets agent is not running")
+                return 1
+            cUtils.dumpJson(status)
+        case "stop":
+            if client.request("stop") is None:
+                print("secrets agent is not running")
+                return 1
+        case "run" | "start":
+            if client.isRunning:
+                print(f"secrets agent is already running ({client.path})")
+                return 0
+            agent = aws.agent.secretsAgent(
+                client.path, ttl=opts.agent_ttl, maxEntries=opts.agent_max_entries, profile=profile
+            )
+            if cmd == "run":
+                agent.serve()
+                return 0
+            logFile = os.path.join(os.environ.get("CLAMITY_HOME", ""), "logs", "secrets-agent.log")
+            if not agent.start(logFile=logFile if os.path.isdir(os.path.dirname(logFile)) else os.devnull):
+                print("secrets agent failed to start", file=sys.stderr)
+                return 1
+            print(f"secrets agent listening on {client.path}")
+    return 0
+
+
+def print_secret_values(values: dict, emit: str, prefix: str = None) -> None:
+    """values is {name: get_secret_value response}"""
+    match emit:
+        case "ndjson":
+            for name in sorted(values):
+                print(json.dumps({"name": name, "value": values[name].get("SecretString")}))
+        case "dotenv":
+            for name in sorted(values):
+                key = re.sub(r"[^A-Za-z0-9_]", "_", name.removeprefix(prefix or "")).upper()
+                print(f"{key}={json.dumps(values[name].get('SecretString') or '')}")
+        case _:
+            cUtils.dumpJson({name: v.get("SecretString") for name, v in values.items()})
+
+
 knownKeyTypes = ["ssh_key", "rds_mysql"]  # see resources.py:secretType
 options = CmdOptions().parser(description=__doc__, usage=Usage, epilog=ActionsAndSupplemental)
 options.add_args(["common", "aws"])
 options.add_argument(
     "action",
-    choices=["list", "types", "delete", "update", "write", "read", "details", "restore", "help"],
+    choices=["list", "types", "delete", "update", "write", "read", "details", "restore", "agent", "help"],
     help="action to take",
 )
+options.add_argument(
+    "agent_cmd", nargs="?", choices=["start", "stop", "status", "run"], default="start", help="agent command"
+)
 options.add_argument("--desc", type=str, help="useful description of the secret (possibly a URL)")
-options.add_argument("--name", type=str, help="secret's path and name (secret store key)")
+options.add_argument(
+    "--name", type=str, action="append", help="secret's path and name (secret store key). Repeat to read many."
+)
+options.add_argument("--prefix", type=str, help="read all secrets whose names start with this path")
+options.add_argument(
+    "--emit",
+    type=str,
+    choices=["json", "ndjson", "dotenv"],
+    help="format for secrets read (default json, or the bare value when reading one --name)",
+)
 options.add_argument("--value", type=str, help="the secret's value")
 options.add_argument("--type", type=str, choices=knownKeyTypes, help="add secret validation")
+options.add_argument("--no-agent", action="store_true", default=False, help="don't read secrets through the secrets agent")
+options.add_argument("--agent-ttl", type=int, default=300, help="seconds the agent caches secrets (default 300)")
+options.add_argument("--agent-max-entries", type=int, default=1000, help="max secrets the agent caches (default 1000)")
 
 if len(sys.argv) == 1:
     options.print_usage()
     exit(1)
 
 opts = options.parse(help="action")
+names = opts.name or []
+if len(names) > 1 and opts.action != "read":
+    print("only one --name allowed", file=sys.stderr)
+    exit(1)
+opts.name = names[0] if names else None
+profiles = [p.strip() for p in (opts.aws_profile or "").split(",") if p.strip()]
+if (len(profiles) > 1 or profiles == ["all"]) and opts.action not in ["list", "types", "help"]:
+    print(f"{opts.action} works with one AWS profile, not '{opts.aws_profile}'", file=sys.stderr)
+    exit(1)
+profile = profiles[0] if profiles else None  # the agent for this profile serves reads
 
 match opts.action:
     case "list":
-        aws.resources.secrets().fetch().print()
+        aws.resources.secrets().fetch(projected=True).print()
 
     case "write":
         if not opts.desc or not opts.value or not opts.name:
@@ -138,41 +243,63 @@ match opts.action:
             },
         )
         s.create()
+        agent_invalidate(opts.name)
 
     case "update":
         if (not opts.desc and not opts.value) or not opts.name:
             print("--name and --value or --desc required when adding a secret", file=sys.stderr)
             exit(1)
-        exit(0 if aws.resources.secrets().fetch().findOne(opts.name).update(desc=opts.desc, value=opts.value) else 1)
+        updated = aws.resources.secrets().get(opts.name).update(desc=opts.desc, value=opts.value)
+        agent_invalidate(opts.name)
+        exit(0 if updated else 1)
 
     case "restore":
         if not opts.name:
             print("--name required", file=sys.stderr)
             exit(1)
-        exit(0 if aws.resources.secret().restore(opts.name) else 1)
+        restored = aws.resources.secret().restore(opts.name)
+        agent_invalidate(opts.name)
+        exit(0 if restored else 1)
 
     case "delete":
         if not opts.name:
             print("--name required", file=sys.stderr)
             exit(1)
-        exit(0 if aws.resources.secrets().fetch().findOne(opts.name).destroy() else 1)
+        destroyed = aws.resources.secrets().get(opts.name).destroy()
+        agent_invalidate(opts.name)
+        exit(0 if destroyed else 1)
 
     case "read":
-        if not opts.name:
-            print("--name required", file=sys.stderr)
+        if not opts.name and not opts.prefix:
+            print("--name or --prefix required", file=sys.stderr)
             exit(1)
-        print_secret_value(aws.resources.secrets().fetch().findOne(opts.name).value)
+        if len(names) == 1 and not opts.prefix and not opts.emit:
+            response = agent_request("read", name=opts.name)
+            print_secret_value(
+                response["value"]["SecretString"] if response else aws.resources.secrets().get(opts.name).value
+            )
+        else:
+            values = aws.resources.secrets().readValues(names, prefix=opts.prefix)
+            print_secret_values(values, opts.emit, prefix=opts.prefix)
+            found = set(values) | {v.get("ARN") for v in values.values()}
+            missing = [n for n in names if n not in found]
+            for n in missing:
+                print(f"secret {n} not found", file=sys.stderr)
+            exit(1 if missing else 0)
 
     case "details":
         if not opts.name:
             print("--name required", file=sys.stderr)
             exit(1)
-        cUtils.dumpJson(
-            {
-                "details": aws.resources.secrets().fetch().findOne(opts.name).details,
-                "secetDetails": aws.resources.secrets().fetch().findOne(opts.name).valueDetails,
-            }
-        )
+        response = agent_request("details", name=opts.name)
+        if response:
+            cUtils.dumpJson({"details": response["details"], "secetDetails": response["value"]})
+        else:
+            s = aws.resources.secrets().get(opts.name)
+            cUtils.dumpJson({"details": s.details, "secetDetails": s.valueDetails})
+
+    case "agent":
+        exit(run_agent(opts.agent_cmd))
 
     case "types":
         print("Known secret types:")
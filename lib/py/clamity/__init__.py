@@ -7,9 +7,17 @@ keys), making common dev ops tasks easier for the end user.
 """
 
 import sys
+import importlib
 if sys.version_info.major + (sys.version_info.minor * .1) < 3.10:
-	print("python 3.10 or greater is required for the devtools package")
-	exit(1)
+    print("python 3.10 or greater is required for the devtools package")
+    exit(1)
 
-from . import core
-from . import aws
+# Subpackages are imported on first use so commands only pay for what they use
+# (clamity.aws pulls in boto3). See clamity.core.importtime.
+_subpackages = ["core", "aws"]
+
+
+def __getattr__(name: str):
+    if name in _subpackages:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
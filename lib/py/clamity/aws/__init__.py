@@ -4,6 +4,14 @@ Classes and methods for managing AWS resources. The resource manager ties
 the more atomic aws resources together and provides the primary interface.
 """
 
-from . import session
-from . import resources
-from . import manager
+import importlib
+
+# Modules are imported on first use. session, resources and manager load boto3
+# which is expensive; agent does not.
+_modules = ["session", "resources", "manager", "agent"]
+
+
+def __getattr__(name: str):
+    if name in _modules:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,223 @@
+"""
+Secrets agent
+
+A long running process, in the spirit of ssh-agent, which holds secret values
+and details in memory for a short time and serves them to clamity commands over
+a unix socket that only the owner can reach. Commands use the agent when it's
+running and fall back to calling AWS themselves when it isn't.
+
+The protocol is one JSON request per line with one JSON response per line.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+import socketserver
+from collections import OrderedDict
+from typing import Optional
+import clamity.core.utils as cUtils
+import clamity.core.daemon as cDaemon
+
+
+def agentProfile(profile: Optional[str] = None) -> str:
+    """the AWS profile an agent serves (profile, $AWS_PROFILE or default)"""
+    return profile or os.environ.get("AWS_PROFILE") or "default"
+
+
+def socketPath(profile: Optional[str] = None) -> Optional[str]:
+    """$CLAMITY_SECRETS_AGENT_SOCK or a per-profile socket in $CLAMITY_HOME/run"""
+    if os.environ.get("CLAMITY_SECRETS_AGENT_SOCK"):
+        return os.environ["CLAMITY_SECRETS_AGENT_SOCK"]
+    if not os.environ.get("CLAMITY_HOME"):
+        return None
+    profile = agentProfile(profile)
+    return os.path.join(os.environ["CLAMITY_HOME"], "run", f"secrets-agent.{profile}.sock")
+
+
+class ttlCache:
+    """Thread safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl: int = 300, maxEntries: int = 1000) -> None:
+        self._ttl = ttl
+        self._maxEntries = maxEntries
+        self._data = OrderedDict()  # key => (expires, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxEntries:
+                self._data.popitem(last=False)  # evict the least recently used
+
+    def invalidate(self, nameOrArn: Optional[str] = None) -> int:
+        """remove entries for a secret (by requested key, name or ARN) or all entries. Returns number removed."""
+        with self._lock:
+            if nameOrArn is None:
+                n = len(self._data)
+                self._data.clear()
+                return n
+            stale = [k for k, (_, v) in self._data.items() if k.endswith(f":{nameOrArn}") or nameOrArn in v.get("ids", [])]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+
+
+class agentClient:
+    """Talks to the running secrets agent for a profile"""
+
+    def __init__(self, path: Optional[str] = None, timeout: int = 30, profile: Optional[str] = None) -> None:
+        self._profile = agentProfile(profile)
+        self._path = path or socketPath(self._profile)
+        self._timeout = timeout
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._path
+
+    @property
+    def isRunning(self) -> bool:
+        return self.request("status") is not None
+
+    def request(self, op: str, **kwargs) -> Optional[dict]:
+        """send a request to the agent. Returns None if the agent isn't running or serves another profile."""
+        if not self._path or not os.path.exists(self._path) or os.stat(self._path).st_uid != os.getuid():
+            return None
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(self._timeout)
+                s.connect(self._path)
+                s.sendall((json.dumps({"op": op, "profile": self._profile, **kwargs}) + "\n").encode())
+                with s.makefile("r") as f:
+                    response = json.loads(f.readline() or "null")
+        except (OSError, ValueError):
+            return None
+        return None if response and response.get("wrongProfile") else response
+
+
+class _requestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        try:
+            response = self.server.agent.handle(json.loads(line))
+        except SystemExit:  # resource lookups report errors and exit()
+            response = {"ok": False, "error": "request failed (see the agent's log)"}
+        except Exception as e:
+            response = {"ok": False, "error": str(e) or "request failed"}
+        self.wfile.write((json.dumps(response, default=cUtils.jsonDateTimeHandler) + "\n").encode())
+
+
+class _unixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class secretsAgent:
+    """Caches secret values and describe data and serves them over a unix socket"""
+
+    _profileOps = ["read", "details", "invalidate"]  # requests for another profile's secrets (shared socket) are refused
+
+    def __init__(
+        self, path: Optional[str] = None, ttl: int = 300, maxEntries: int = 1000, profile: Optional[str] = None
+    ) -> None:
+        self._profile = agentProfile(profile)
+        self._path = path or socketPath(self._profile)
+        self._cache = ttlCache(ttl=ttl, maxEntries=maxEntries)
+        self._ttl = ttl
+        self._maxEntries = maxEntries
+        self._server = None
+
+    def _cached(self, key: str, loader) -> dict:
+        value = self._cache.get(key)
+        if value is None:
+            value = loader()
+            self._cache.put(key, value)
+        return value
+
+    def _read(self, name: str, region: Optional[str]) -> dict:
+        from . import resources
+
+        def load() -> dict:
+            s = resources.secrets().get(name, **({"region": region} if region else {}))
+            try:
+                return {"ids": [s.name, s.arn], "value": s.valueDetails}
+            finally:
+                resources.secretCache().clear()  # this agent's ttl cache is the only copy it keeps
+
+        return self._cached(f"value:{region}:{name}", load)
+
+    def _details(self, name: str, region: Optional[str]) -> dict:
+        from . import resources
+
+        def load() -> dict:
+            s = resources.secrets().get(name, **({"region": region} if region else {}))
+            try:
+                return {"ids": [s.name, s.arn], "details": s.details}
+            finally:
+                resources.secretCache().clear()
+
+        return self._cached(f"details:{region}:{name}", load)
+
+    def handle(self, request: dict) -> dict:
+        region = request.get("region")
+        if request.get("op") in self._profileOps and request.get("profile", self._profile) != self._profile:
+            return {"ok": False, "wrongProfile": True, "error": f"the agent serves profile {self._profile}"}
+        match request.get("op"):
+            case "read":
+                return {"ok": True, **self._read(request["name"], region)}
+            case "details":
+                return {"ok": True, **self._details(request["name"], region), **self._read(request["name"], region)}
+            case "invalidate":
+                return {"ok": True, "removed": self._cache.invalidate(request.get("name"))}
+            case "status":
+                return {
+                    "ok": True,
+                    "pid": os.getpid(),
+                    "socket": self._path,
+                    "profile": self._profile,
+                    "entries": len(self._cache),
+                    "maxEntries": self._maxEntries,
+                    "ttl": self._ttl,
+                    "hits": self._cache.hits,
+                    "misses": self._cache.misses,
+                }
+            case "stop":
+                threading.Thread(target=self._server.shutdown).start()
+                return {"ok": True}
+        return {"ok": False, "error": f"unknown request {request.get('op')}"}
+
+    def serve(self) -> None:
+        """serve requests until stopped (foreground)"""
+        self._server = cDaemon.bindSocket(self._path, lambda: _unixServer(self._path, _requestHandler))
+        self._server.agent = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            cDaemon.removeSocket(self._path)
+
+    def start(self, logFile: str = os.devnull) -> bool:
+        """run the agent in the background. Returns True once it's accepting requests."""
+        cDaemon.daemonize(self.serve, logFile)
+        for _ in range(50):
+            if agentClient(self._path).isRunning:
+                return True
+            time.sleep(0.1)
+        return False
@@ -3,13 +3,24 @@ Lowest level AWS resources with a standardized interface.
 """
 
 from abc import ABC, abstractmethod
-from typing import Optional, Self, Callable
+from typing import Optional, Self, Iterator
 from enum import Enum
+import os
 import sys
+import csv
 import json
-import deepdiff
+import time
+import bisect
+import operator
+import hashlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import botocore.exceptions
 import clamity.core.utils as cUtils
 import clamity.core.options as cOptions
+import clamity.core.cache as cCache
+import clamity.core.telemetry as telemetry
 from . import session
 
 
@@ -23,39 +34,123 @@ def _assembleTagList(tagDict: dict) -> list:
     return [{"Key": key, "Value": value} for key, value in tagDict.items()]
 
 
+def parseFilterArgs(filterArgs: Optional[list]) -> dict:
+    """['vpc-id=vpc-123', 'tag:Env=prod,stage'] -> {'vpc-id': ['vpc-123'], 'tag:Env': ['prod', 'stage']}"""
+    filter = {}
+    for f in filterArgs or []:
+        if "=" not in f:
+            print(f"filter '{f}' must be in the form key=value[,value...]", file=sys.stderr)
+            exit(1)
+        key, values = f.split("=", 1)
+        values = [v for v in values.split(",") if v]
+        if not key.strip() or not values:
+            print(f"filter '{f}' must be in the form key=value[,value...]", file=sys.stderr)
+            exit(1)
+        filter.setdefault(key.strip(), []).extend(values)
+    return filter
+
+
+def _filterVariant(filter: dict) -> Optional[str]:
+    """stable cache key for a filter spec (None for unfiltered requests)"""
+    if not filter:
+        return None
+    return hashlib.sha1(json.dumps(filter, sort_keys=True).encode()).hexdigest()[:12]
+
+
 # Printing resource data
-def _printLineFormatData(fieldOrder, fieldProps: dict) -> dict:
-    """create a format string and hyphen separators for use with line printing"""
-    fmtString = ""
-    i = 0
-    separators = []  # underscores under header
-    for col in fieldOrder:
-        alignment = ">" if "align-right" in fieldProps[col] else ""
-        fmtString += "{" + str(i) + ":" + alignment + str(fieldProps[col]["width"]) + "s}  "
-        separators.append("-" * fieldProps[col]["width"])
-        i += 1
-    return {"formatString": fmtString, "separators": separators}
-
-
-def _printTableHeader(displayFields: list, displayFieldProps: dict) -> None:
-    """print line headers and separator for tabular listing"""
-    lineFormat = _printLineFormatData(displayFields, displayFieldProps)
-    print(lineFormat["formatString"].format(*displayFields))
-    print(lineFormat["formatString"].format(*lineFormat["separators"]))
-
-
-def _printTableLine(obj: any, displayFields: list, displayFieldProps: dict, truncate=True) -> None:
-    """Print resource on a line for tabular listing"""
-    lineFormat = _printLineFormatData(displayFields, displayFieldProps)
-    orderedData = [
-        (
-            (getattr(obj, field) or "-")
-            if not truncate
-            else cUtils.shortenWithElipses((getattr(obj, field) or "-"), displayFieldProps[field]["width"])
-        )
-        for field in displayFields
-    ]
-    print(lineFormat["formatString"].format(*orderedData))
+class _tableRenderer:
+    """Tabular text output for a resource class. The column layout (format string, separators and
+    field getter) is compiled once and rows are streamed to the output in batches."""
+
+    _flushRows = 500  # max rows buffered before writing
+    _flushSecs = 0.25  # max seconds a buffered row waits to be written (keeps streamed output flowing)
+
+    def __init__(self, fields: list, fieldProps: dict, truncate: bool = True, outputStream=None) -> None:
+        self._fields = fields
+        self._rightAligned = ["align-right" in fieldProps[f] for f in fields]
+        self._truncate = truncate
+        self._outputStream = outputStream or sys.stdout
+        getter = operator.attrgetter(*fields)
+        self._getter = getter if len(fields) > 1 else lambda obj: (getter(obj),)
+        self._compile([fieldProps[f]["width"] for f in fields])
+
+    def _compile(self, widths: list) -> None:
+        self._widths = widths
+        self._format = "".join(
+            "{" + str(i) + ":" + (">" if right else "") + str(w) + "s}  "
+            for i, (w, right) in enumerate(zip(widths, self._rightAligned))
+        ).format
+        self._separators = ["-" * w for w in widths]
+
+    def values(self, obj: any) -> tuple:
+        """the row's display values"""
+        return tuple((v or "-") if v is None or v.__class__ is str else str(v) for v in self._getter(obj))
+
+    def autoFit(self, rows: list) -> None:
+        """size columns to the widest header or value in rows (a list of values())"""
+        widths = [len(f) for f in self._fields]
+        for row in rows:
+            widths = [max(w, len(v)) for w, v in zip(widths, row)]
+        self._compile(widths)
+
+    def line(self, values: tuple) -> str:
+        if self._truncate:
+            values = [v if len(v) <= w else v[: w - 3] + "..." for v, w in zip(values, self._widths)]
+        return self._format(*values)
+
+    def header(self) -> None:
+        self._outputStream.write(self._format(*self._fields) + "\n" + self._format(*self._separators) + "\n")
+
+    def write(self, rows: Iterator[tuple]) -> int:
+        """write rows (values()) in batches. Returns the number of rows written."""
+        numRows = 0
+        buffer = []
+        lastFlush = time.monotonic()
+        for row in rows:
+            buffer.append(self.line(row))
+            numRows += 1
+            if len(buffer) >= self._flushRows or time.monotonic() - lastFlush > self._flushSecs:
+                self._outputStream.write("\n".join(buffer) + "\n")
+                self._outputStream.flush()
+                buffer = []
+                lastFlush = time.monotonic()
+        if buffer:
+            self._outputStream.write("\n".join(buffer) + "\n")
+        self._outputStream.flush()
+        return numRows
+
+
+class _delimitedRenderer:
+    """CSV or TSV output for a resource class. Rows are written as they're produced."""
+
+    _tsvEscapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+    def __init__(self, fields: list, delimiter: str = ",", outputStream=None) -> None:
+        self._fields = fields
+        self._tsv = delimiter == "\t"
+        quoting = {"quoting": csv.QUOTE_NONE, "quotechar": None} if self._tsv else {}  # tsv values are escaped instead
+        self._writer = csv.writer(outputStream or sys.stdout, delimiter=delimiter, lineterminator="\n", **quoting)
+        getter = operator.attrgetter(*fields)
+        self._getter = getter if len(fields) > 1 else lambda obj: (getter(obj),)
+
+    def values(self, obj: any) -> tuple:
+        if self._tsv:
+            return tuple("" if v is None else str(v).translate(self._tsvEscapes) for v in self._getter(obj))
+        return tuple("" if v is None else v for v in self._getter(obj))
+
+    def header(self) -> None:
+        self._writer.writerow(self._fields)
+
+    def write(self, rows: Iterator[tuple]) -> None:
+        self._writer.writerows(rows)
+
+
+def _newRenderer(output: cOptions.outputFormat, fields: list, fieldProps: dict, truncate: bool = True):
+    if output == cOptions.outputFormat.CSV:
+        return _delimitedRenderer(fields, delimiter=",")
+    if output == cOptions.outputFormat.TSV:
+        return _delimitedRenderer(fields, delimiter="\t")
+    return _tableRenderer(fields, fieldProps, truncate=truncate)
 
 
 def _checkHttpResponse(response: dict) -> bool:
@@ -67,13 +162,21 @@ def _checkHttpResponse(response: dict) -> bool:
 
 
 _resourceCacheData = {}
+_resourceCacheGenerations = {}  # resource class name => number of times its cached data has been patched
 
 
 class resourceCache:
+    """Regional describe data for one resource class. The in-memory copy is shared
+    by all instances in the process and backed by a file cache keyed by account,
+    region and resource class."""
+
+    session = session.sessionSettings()
+    options = cOptions.CmdOptions()
 
-    def __init__(self, resourceClassName: str) -> None:
-        global _resourceCacheData
+    def __init__(self, resourceClassName: str, ttl: int = 300, enabled: bool = True) -> None:
         self._resourceClassName = resourceClassName
+        self._ttl = ttl
+        self._enabled = enabled  # False for one-off lookups not worth caching
         if resourceClassName not in _resourceCacheData:
             _resourceCacheData[resourceClassName] = {}
         self._data = _resourceCacheData[resourceClassName]
@@ -82,16 +185,97 @@ class resourceCache:
     def data(self) -> None:
         return self._data
 
-    def replace(self, newData: dict, region: str):
-        self.data[region] = newData
+    @property
+    def enabled(self) -> bool:
+        return self._enabled and not self.options.args.no_cache
+
+    def _diskCache(self, region: str, variant: Optional[str] = None) -> cCache.diskCache:
+        """keyed by account rather than profile. Without a named profile the credentials (environment, role,
+        ...) can change between commands and 'default' would serve one account's data for another."""
+        name = f"{self._resourceClassName}.{variant}" if variant else self._resourceClassName
+        return cCache.diskCache(["aws", self.session.accountId, region, name], ttl=self._ttl)
+
+    def _key(self, region: str, variant: Optional[str] = None) -> str:
+        """full result sets are keyed by profile and region, filtered ones by filter variant too"""
+        key = f"{self.session.profile}:{region}"
+        return f"{key}#{variant}" if variant else key
+
+    def replace(self, newData: dict, region: str, variant: Optional[str] = None):
+        self.data[self._key(region, variant)] = newData
+        if self.enabled:
+            self._diskCache(region, variant).save(newData)
+
+    def expire(self, region: str, variant: Optional[str] = None) -> None:
+        """drop the in-memory and disk copies so the next fetch calls AWS (and caches what it gets)"""
+        self._data.pop(self._key(region, variant), None)
+        if self.enabled:
+            self._diskCache(region, variant).remove()
+
+    def release(self, region: str, variant: Optional[str] = None) -> None:
+        """drop the in-memory copy (the disk cache is kept)"""
+        self._data.pop(self._key(region, variant), None)
+
+    @property
+    def generation(self) -> int:
+        return _resourceCacheGenerations.get(self._resourceClassName, 0)
+
+    def patch(self, region: str, idKey: str, id: str, describeData: Optional[dict] = None) -> None:
+        """Write through a change made to one resource: replace (or add) the cached describe data whose
+        idKey is id, or remove it if describeData is None. Filtered result sets for the region are
+        dropped since there's no telling whether the change matches the filter."""
+
+        def apply(data: list) -> list:
+            patched, found = [], False
+            for r in data:
+                if r.get(idKey) != id:
+                    patched.append(r)
+                elif describeData:
+                    patched.append(describeData)
+                    found = True
+            if describeData and not found:
+                patched.append(describeData)
+            return patched
+
+        key = self._key(region)
+        if key in self._data:
+            self._data[key] = apply(self._data[key])  # a new list, collections may be iterating the old one
+        if self.enabled:
+            self._diskCache(region).update(apply)
+        for k in [k for k in self._data if k.startswith(f"{key}#")]:
+            del self._data[k]
+        if self.enabled:
+            self._removeVariants(region)
+        _resourceCacheGenerations[self._resourceClassName] = self.generation + 1
+        telemetry.count("cache.patch", resource=self._resourceClassName, region=region)
+
+    def _removeVariants(self, region: str) -> None:
+        path = self._diskCache(region).path
+        if not path or not os.path.isdir(os.path.dirname(path)):
+            return
+        prefix = os.path.basename(path)[: -len(".json")] + "."
+        for f in os.listdir(os.path.dirname(path)):
+            if f.startswith(prefix) and f.endswith(".json") and f != os.path.basename(path):
+                os.unlink(os.path.join(os.path.dirname(path), f))
 
-    def regionalData(self, region=str, **kwargs) -> dict:
+    def regionalData(self, region=str, variant: Optional[str] = None, **kwargs) -> dict:
         r = kwargs["region"] if "region" in kwargs else region
-        return self.data[r]
+        return self.data[self._key(r, variant)]
 
-    def hasRegionalDataFor(self, region=str, **kwargs) -> bool:
+    def hasRegionalDataFor(self, region=str, variant: Optional[str] = None, **kwargs) -> bool:
         r = kwargs["region"] if "region" in kwargs else region
-        return bool(r in self._data)
+        if self._key(r, variant) in self._data:
+            telemetry.count("cache.memory.hit", resource=self._resourceClassName, region=r)
+            return True
+        if self.enabled and not self.options.args.refresh:
+            cachedData = self._diskCache(r, variant).load()
+            if cachedData is not None:
+                if self.options.args.debug:
+                    print(f"debug: using cached {self._resourceClassName} data for {self._key(r, variant)}", file=sys.stderr)
+                telemetry.count("cache.disk.hit", resource=self._resourceClassName, region=r)
+                self._data[self._key(r, variant)] = cachedData
+                return True
+        telemetry.count("cache.miss", resource=self._resourceClassName, region=r)
+        return False
 
     #         if category not in self.data:
     #             self.data[category] = {region: {}}
@@ -128,6 +312,84 @@ class resourceCache:
     #             return self.data[category][region][kwargs["TransitGatewayRouteTableId"]]
 
 
+_secretCacheData = {"details": {}, "values": {}, "stages": {}, "arns": {}}
+_secretCacheLock = threading.Lock()
+
+
+class secretCache:
+    """Secret describe data and values read by this process, so reading a secret more than once in a
+    command only calls AWS the first time. Values are keyed by ARN and VersionId; version stages
+    (AWSCURRENT, AWSPREVIOUS, ...) map to the version they were last read as. Secrets are looked up
+    by ARN or by region and name. Entries for a secret are invalidated when it's changed and expire
+    after ttl seconds (None to keep them for the life of the process). Nothing is written to disk."""
+
+    def __init__(self, ttl: Optional[int] = None) -> None:
+        self._ttl = ttl
+        self._data = _secretCacheData
+
+    def _arn(self, secretId: str, region: Optional[str]) -> Optional[str]:
+        return secretId if secretId.startswith("arn:") else self._data["arns"].get((region, secretId))
+
+    def _fresh(self, entry: Optional[tuple]) -> Optional[dict]:
+        if entry is None or (self._ttl is not None and time.monotonic() - entry[0] > self._ttl):
+            return None
+        return entry[1]
+
+    def _remember(self, response: dict, region: Optional[str]) -> str:
+        self._data["arns"][(region, response["Name"])] = response["ARN"]
+        return response["ARN"]
+
+    def details(self, secretId: str, region: Optional[str] = None) -> Optional[dict]:
+        """the cached describe_secret response"""
+        with _secretCacheLock:
+            arn = self._arn(secretId, region)
+            return self._fresh(self._data["details"].get(arn)) if arn else None
+
+    def putDetails(self, response: dict, region: Optional[str] = None) -> None:
+        with _secretCacheLock:
+            arn = self._remember(response, region)
+            self._data["details"][arn] = (time.monotonic(), response)
+
+    def value(
+        self,
+        secretId: str,
+        region: Optional[str] = None,
+        versionId: Optional[str] = None,
+        versionStage: str = "AWSCURRENT",
+    ) -> Optional[dict]:
+        """the cached get_secret_value response for a version (by id or stage)"""
+        with _secretCacheLock:
+            arn = self._arn(secretId, region)
+            if arn and not versionId:
+                versionId = self._data["stages"].get((arn, versionStage))
+            return self._fresh(self._data["values"].get((arn, versionId))) if arn and versionId else None
+
+    def putValue(self, response: dict, region: Optional[str] = None) -> None:
+        """cache a get_secret_value (or batch_get_secret_value) response"""
+        with _secretCacheLock:
+            arn = self._remember(response, region)
+            self._data["values"][(arn, response["VersionId"])] = (time.monotonic(), response)
+            for stage in response.get("VersionStages") or []:
+                self._data["stages"][(arn, stage)] = response["VersionId"]
+
+    def invalidate(self, secretId: str, region: Optional[str] = None) -> None:
+        """forget everything about a secret (call it whenever the secret is changed)"""
+        with _secretCacheLock:
+            arn = self._arn(secretId, region)
+            if not arn:
+                return
+            self._data["details"].pop(arn, None)
+            for cache in (self._data["values"], self._data["stages"]):
+                for key in [k for k in cache if k[0] == arn]:
+                    del cache[key]
+
+    def clear(self) -> None:
+        """forget every secret (eg. a long running process that keeps values in a cache of its own)"""
+        with _secretCacheLock:
+            for cache in self._data.values():
+                cache.clear()
+
+
 class resourceType(Enum):
     UNKNOWN = 0
     VPC = 1
@@ -145,11 +407,18 @@ class resourceType(Enum):
     NATGW = 13
 
 
+def _serializable(v: any) -> any:
+    return v.name if isinstance(v, Enum) else v
+
+
 # One AWS resource (abstract)
 class _resource(ABC):
     session = session.sessionSettings()
     options = cOptions.CmdOptions()
     _props = {}  # allow for prototyping properties when creating new instance
+    _keyFields = ["id", "name"]  # always kept by compact records (collections index by them)
+    _dumpFields = ["resourceType", "id", "name", "region", "exists", "tags"]  # read from describe data (cheap)
+    _expensiveDumpFields = []  # need AWS API calls so are only serialized on request
 
     # these should be attributes -  is there a better way to abstract them?
     @property
@@ -173,6 +442,7 @@ class _resource(ABC):
         self._describeData = {}
         self._newData = {}
         self._region = self.get_region(**kwargs)
+        self._profile = self.session.profileName
         if "_describeData" in kwargs:  # loaded from AWS
             self._exists = True
             # self._region = kwargs["region"]
@@ -228,12 +498,26 @@ class _resource(ABC):
     def region(self) -> Optional[str]:
         return self._region
 
+    @property
+    def profile(self) -> Optional[str]:
+        """the AWS profile the resource was loaded with (None if no profile was named)"""
+        return self._profile
+
+    @property
+    def account(self) -> Optional[str]:
+        with self.session.usingProfile(self._profile):
+            return self.session.accountId
+
     def get_region(self, **kwargs) -> Optional[str]:
         return kwargs["region"] if "region" in kwargs else self.session.default_region
 
     @property
     def isDirty(self) -> bool:
-        return True if self._describeData and self._newData and deepdiff(self._describeData, self._newData) else False
+        import deepdiff  # only needed here, and it's slow to import
+
+        return (
+            True if self._describeData and self._newData and deepdiff.DeepDiff(self._describeData, self._newData) else False
+        )
 
     @property
     def tags(self) -> dict:
@@ -242,7 +526,9 @@ class _resource(ABC):
         return _parseTagList(self._newData["Tags"] if "Tags" in self._newData else {})
 
     def updateTags(self, newTags: dict) -> None:
-        changes = _assembleTagList(deepdiff(self.tags, {**self.tags, **newTags}))
+        import deepdiff
+
+        changes = _assembleTagList(deepdiff.DeepDiff(self.tags, {**self.tags, **newTags}))
         print(changes)
         # call boto tag change here
 
@@ -266,59 +552,529 @@ class _resource(ABC):
         output = kwargs["output"] if "output" in kwargs else self.options.args.output_format
         truncate = kwargs["truncate"] if "truncate" in kwargs else self.options.args.truncate
         header = kwargs["header"] if "header" in kwargs else self.options.args.header
-        if output == cOptions.outputFormat.JSON:
+        fields, fieldProps = self.displayFields(kwargs["columns"] if "columns" in kwargs else self.options.args.columns)
+        if output == cOptions.outputFormat.NDJSON or (output == cOptions.outputFormat.JSON and self.options.args.compact):
+            cUtils.dumpJsonStream([self._describeData], ndjson=True)
+        elif output == cOptions.outputFormat.JSON:
             cUtils.dumpJson(self._describeData)
         else:
+            renderer = _newRenderer(output, fields, fieldProps, truncate=truncate)
             if header:
-                _printTableHeader(self._displayFieldOrder, self._displayFieldProps)
-            _printTableLine(self, self._displayFieldOrder, self._displayFieldProps, truncate=truncate)
+                renderer.header()
+            renderer.write([renderer.values(self)])
+
+    def serialize(self, expand: list = []) -> dict:
+        """the declared fields as a dict, without any AWS API calls unless expensive fields are named in expand"""
+        for f in expand:
+            if f not in self._expensiveDumpFields:
+                print(f"{f} is not an expandable field of {self.__class__.__name__}", file=sys.stderr)
+                exit(1)
+        return {f: _serializable(getattr(self, f)) for f in self._dumpFields + list(expand)}
+
+    @classmethod
+    def displayFields(cls, columns: list = []) -> tuple:
+        """returns (fields, fieldProps) for the default display fields or the selected columns"""
+        if not columns:
+            return cls._displayFieldOrder, cls._displayFieldProps
+        for c in columns:
+            if c.startswith("_") or not hasattr(cls, c):
+                print(f"unknown column '{c}' for {cls.__name__}", file=sys.stderr)
+                exit(1)
+        return columns, {c: cls._displayFieldProps.get(c, {"width": 20}) for c in columns}
 
     def _describeDataProp(self, propName: str) -> Optional[str]:
         """fetch data based on factors such as existance, defunct-ness, etc..."""
-        return (
-            self._describeData[propName] if self.exists and not self.isDefunct and self._describeData.get(propName) else None
-        )
+        # called for every displayed field so it checks the flags directly rather than via isDefunct
+        return self._describeData.get(propName) or None if self._exists and not self._defunct else None
+
+
+class _projection:
+    """The fields compact records of one resource class keep. Shared by all records of a fetch."""
+
+    __slots__ = ("resourceClass", "collectionClass", "fields", "index")
+
+    def __init__(self, resourceClass: type, collectionClass: type, fields: list) -> None:
+        self.resourceClass = resourceClass
+        self.collectionClass = collectionClass
+        self.fields = tuple(dict.fromkeys(resourceClass._keyFields + list(fields)))  # unique, in order
+        self.index = {f: i for i, f in enumerate(self.fields)}
+
+    def record(self, r: _resource) -> "_compactResource":
+        return _compactResource(self, tuple(getattr(r, f) for f in self.fields), r.region, r.profile)
+
+
+class _compactResource:
+    """A resource reduced to the fields a command needs (see _resources.fetch(projected=...)). Anything
+    else, including the describe data, comes from the full resource which is described again on first use."""
+
+    __slots__ = ("_projection", "_values", "_region", "_profile", "_full")
+
+    def __init__(self, projection: _projection, values: tuple, region: Optional[str], profile: Optional[str]) -> None:
+        self._projection = projection
+        self._values = values
+        self._region = region
+        self._profile = profile
+        self._full = None
+
+    def __getattr__(self, name: str):  # only called for attributes which aren't slots
+        if name.startswith("_"):  # private, or a slot that isn't set yet (eg. copy and pickle probing)
+            raise AttributeError(name)
+        i = self._projection.index.get(name)
+        if i is not None:
+            return self._values[i]
+        if not hasattr(self._projection.resourceClass, name):  # not a resource field, don't describe it again
+            raise AttributeError(f"{self._projection.resourceClass.__name__!r} object has no attribute {name!r}")
+        return getattr(self.hydrate(), name)
+
+    def __repr__(self) -> str:
+        return f"<compact {self._projection.resourceClass.__name__} {self.id}>"
+
+    @property
+    def region(self) -> Optional[str]:
+        return self._region
+
+    @property
+    def profile(self) -> Optional[str]:
+        return self._profile
+
+    @property
+    def account(self) -> Optional[str]:
+        with _resource.session.usingProfile(self._profile):
+            return _resource.session.accountId
+
+    def displayFields(self, columns: list = []) -> tuple:
+        return self._projection.resourceClass.displayFields(columns)
+
+    def serialize(self, expand: list = []) -> dict:
+        """the declared fields which were projected (serialize the hydrated resource for the rest)"""
+        if expand:
+            return self.hydrate().serialize(expand=expand)
+        index = self._projection.index
+        return {
+            "resourceType": _serializable(self._projection.resourceClass.resourceType),
+            "region": self._region,
+            **{f: _serializable(self._values[index[f]]) for f in self._projection.resourceClass._dumpFields if f in index},
+        }
+
+    def hydrate(self) -> _resource:
+        """the full resource"""
+        if self._full is None:
+            with _resource.session.usingProfile(self._profile):
+                self._full = self._projection.collectionClass(region=self._region)._hydrate(self.id, self._region)
+            if self._full is None:
+                print(f"{self._projection.resourceClass.__name__} {self.id} no longer exists", file=sys.stderr)
+                exit(1)
+        return self._full
+
+
+def _fingerprint(r) -> any:
+    """what a re-fetched resource is compared on to tell whether it changed"""
+    return r._values if isinstance(r, _compactResource) else r._describeData
+
+
+class fetchDelta:
+    """What a fetch changed in a collection (see _resources.delta)"""
+
+    __slots__ = ("added", "changed", "removed")
+
+    def __init__(self) -> None:
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self) -> str:
+        return f"<fetchDelta added={len(self.added)} changed={len(self.changed)} removed={len(self.removed)}>"
 
 
 # Collection of AWS resource (abstract)
 class _resources(ABC):
     session = session.sessionSettings()
     options = cOptions.CmdOptions()
+    _cacheTTL = 300  # seconds cached describe data is considered fresh
+    _maxFetchWorkers = 16  # max concurrent regional fetches (across all accounts)
+    _idFilter = None  # describe call's filter name for resource ids (eg. vpc-id)
+    _filtersParam = "Filters"
+    _filterNames = {"name": "tag:Name"}  # filter spec keys => describe call filter names
+    _uniqueNames = False  # names identify one resource (not true of EC2 Name tags)
+    _watchBackoff = 1.5  # watch() poll interval multiplier while nothing changes
+    _watchMarkers = {"added": ("+", 32), "changed": ("~", 33), "removed": ("-", 31)}  # marker, ANSI color
 
     def __init__(self, **kwargs) -> None:
-        self._resourceCache = resourceCache(self.__class__.__name__)
+        self._resourceCache = resourceCache(self.__class__.__name__, ttl=self._cacheTTL)
         self._resourcesList = []
+        self._pending = None  # generator of fetched resources not yet added to _resourcesList
+        self._byKey = {}  # (region, id) => index in _resourcesList
+        self._fetchedBy = {}  # (region, id) => ((profile, region, filter variant), ...) fetches which returned it
+        self._delta = fetchDelta()
+        self._byId = {}  # id => resource
+        self._byName = {}  # name => [resource, ...]
+        self._sortedNames = None  # built on demand for prefix lookups
         self._region = self.get_region(**kwargs)
-
-    def __iter__(self):
-        return iter(self._resourcesList)
+        self._regions = set()  # regions fetched
+        self._profiles = set()  # profiles fetched with
+        self._generation = self._resourceCache.generation  # see isStale
+        self._clientFilters = {}  # filter variant => describe data check (see _clientFilter)
+        self._resourceClass = None  # the resource class last fetched (see _print)
+        self._failedTargets = set()  # (profile, region) targets a fetch failed for (see print)
+
+    def __iter__(self) -> Iterator[_resource]:
+        """iterate over the collection, pulling pending resources in as needed"""
+        i = 0
+        while True:
+            while i < len(self._resourcesList):
+                yield self._resourcesList[i]
+                i += 1
+            if not self._nextPending():
+                return
 
     def __getitem__(self, item):
+        self._consumePending()
         return self._resourcesList[item]
 
     def __len__(self):
+        self._consumePending()
         return len(self._resourcesList)
 
-    def _fetch(self, cacheKey: str, new_resource: _resource, botoFunc: Callable, botoFuncOpts: dict = {}, **kwargs) -> Self:
-        self._region = kwargs["region"] if "region" in kwargs else self.session.default_region
-        if not self._resourceCache.hasRegionalDataFor(self.region):
-            response: dict = botoFunc(**botoFuncOpts)
-            if not _checkHttpResponse(response):
-                return self
-            self._resourceCache.replace(response.get(cacheKey) or [], self.region)
-            # cUtils.dumpJson(response)
-            # exit(1)
-        r: _resource
-        for r in self._resourceCache.regionalData(self.region):
-            self._resourcesList.append(new_resource(_describeData=r, region=self.region))
+    def _nextPending(self) -> bool:
+        """move the next pending resource into the collection. False if there are none."""
+        if self._pending is None:
+            return False
+        r = next(self._pending, None)
+        if r is None:
+            self._pending = None
+            return False
+        self._add(r)
+        return True
+
+    def _consumePending(self) -> None:
+        if self._pending is not None:
+            for r in self._pending:
+                self._add(r)
+            self._pending = None
+
+    def _add(self, r: _resource) -> None:
+        """add a resource to the collection and its indexes. Resources are keyed by region and id so a
+        re-fetched one replaces the one already in the collection (if it changed)."""
+        key = (r.region, r.id)
+        i = self._byKey.get(key) if r.id else None
+        if i is None:
+            if r.id:
+                self._byKey[key] = len(self._resourcesList)
+            self._resourcesList.append(r)
+            self._index(r)
+            self._delta.added.append(r)
+        elif _fingerprint(self._resourcesList[i]) != _fingerprint(r):
+            self._unindex(self._resourcesList[i])
+            self._resourcesList[i] = r
+            self._index(r)
+            self._delta.changed.append(r)
+
+    def _index(self, r: _resource) -> None:
+        if r.id:
+            self._byId[r.id] = r
+        if r.name:
+            self._byName.setdefault(r.name, []).append(r)
+            self._sortedNames = None
+
+    def _unindex(self, r: _resource) -> None:
+        if r.id and self._byId.get(r.id) is r:
+            del self._byId[r.id]
+        if r.name in self._byName:
+            self._byName[r.name] = [x for x in self._byName[r.name] if x is not r]
+            if not self._byName[r.name]:
+                del self._byName[r.name]
+            self._sortedNames = None
+
+    def _merge(self, fetched: Iterator[_resource], scopes: set, failed: set = frozenset()) -> Iterator[_resource]:
+        """pass fetched resources through, noting which fetch returned them. Once the fetch is complete,
+        resources a previous fetch of the same regions and filter returned but this one didn't are removed
+        (unless fetching from their (profile, region) target failed)."""
+        seen = set()
+        scopeOf = {scope[:2]: scope for scope in scopes}  # one (profile, region, variant) tuple shared by all resources
+        for r in fetched:
+            key = (r.region, r.id)
+            seen.add(key)
+            fetchedBy = self._fetchedBy.get(key, ())
+            scope = scopeOf[(r.profile, r.region)]
+            if scope not in fetchedBy:
+                self._fetchedBy[key] = fetchedBy + (scope,)
+            yield r
+        scopes = {scope for scope in scopes if scope[:2] not in failed}
+        gone = []
+        for key, fetchedBy in self._fetchedBy.items():
+            if key not in seen and not scopes.isdisjoint(fetchedBy):
+                self._fetchedBy[key] = tuple(scope for scope in fetchedBy if scope not in scopes)
+                if not self._fetchedBy[key]:
+                    gone.append(key)
+        if gone:
+            self._remove(gone)
+
+    def _remove(self, keys: list) -> None:
+        for key in keys:
+            del self._fetchedBy[key]
+            i = self._byKey.pop(key, None)
+            if i is not None:
+                self._unindex(self._resourcesList[i])
+                self._delta.removed.append(self._resourcesList[i])
+                self._resourcesList[i] = None
+        self._resourcesList = [r for r in self._resourcesList if r is not None]
+        self._byKey = {(r.region, r.id): i for i, r in enumerate(self._resourcesList) if r.id}
+
+    @property
+    def delta(self) -> fetchDelta:
+        """resources added, changed and removed by the most recent fetch() (which this completes)"""
+        self._consumePending()
+        return self._delta
+
+    def stream(self) -> Iterator[_resource]:
+        """yield resources as they're fetched without retaining pending ones in the collection"""
+        yield from self._resourcesList
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            yield from pending
+
+    def _pages(self, service: str, operation: str, botoFuncOpts: dict, region: str) -> Iterator[dict]:
+        """yield response pages, following NextToken if the operation can be paginated. Each page is its
+        own call so a throttled page is retried without starting over."""
+        client = self.session.client(service, region)
+        if not client.can_paginate(operation):
+            yield self.session.call(client, operation, **botoFuncOpts)
+            return
+        opts = dict(botoFuncOpts)
+        while True:
+            page = self.session.call(client, operation, **opts)
+            yield page
+            if not page.get("NextToken"):
+                return
+            opts["NextToken"] = page["NextToken"]
+
+    def _streamResources(
+        self,
+        cacheKey: str,
+        new_resource: _resource,
+        service: str,
+        operation: str,
+        botoFuncOpts: dict,
+        region: str,
+        variant: Optional[str] = None,
+        keepInMemory: bool = True,
+    ) -> Iterator[_resource]:
+        """yield the region's resources from the cache or as pages arrive. Compact records are fetched with
+        keepInMemory False so the describe data isn't held for the life of the process."""
+        match = self._clientFilters.get(variant)  # cached data is what the describe call returned
+        for r in self._regionalDescribeData(cacheKey, service, operation, botoFuncOpts, region, variant, keepInMemory):
+            if not match or match(r):
+                yield new_resource(_describeData=r, region=region)
+
+    def _regionalDescribeData(
+        self,
+        cacheKey: str,
+        service: str,
+        operation: str,
+        botoFuncOpts: dict,
+        region: str,
+        variant: Optional[str],
+        keepInMemory: bool,
+    ) -> Iterator[dict]:
+        if self._resourceCache.hasRegionalDataFor(region, variant=variant):
+            cachedData = self._resourceCache.regionalData(region, variant=variant)
+            if not keepInMemory:
+                self._resourceCache.release(region, variant=variant)
+            yield from cachedData
+            return
+        cacheData = [] if self._resourceCache.enabled else None  # don't hold onto data we won't cache
+        for page in self._pages(service, operation, botoFuncOpts, region):
+            if not _checkHttpResponse(page):
+                return
+            for r in page.get(cacheKey) or []:
+                if cacheData is not None:
+                    cacheData.append(r)
+                yield r
+        if cacheData is not None:
+            self._resourceCache.replace(cacheData, region, variant=variant)
+            if not keepInMemory:
+                self._resourceCache.release(region, variant=variant)
+
+    def _fetchRegions(
+        self,
+        cacheKey: str,
+        new_resource: _resource,
+        service: str,
+        operation: str,
+        botoFuncOpts: dict,
+        targets: list,
+        variant: Optional[str] = None,
+        keepInMemory: bool = True,
+        failed: Optional[set] = None,
+    ) -> Iterator[_resource]:
+        """fetch from all (profile, region) targets concurrently, yielding each one's resources as it completes.
+        Requests are rate limited per profile and region (see session). A target which fails is reported and
+        added to failed; the others' resources are still yielded."""
+        failed = set() if failed is None else failed
+
+        def fetchRegion(profile: Optional[str], region: str) -> list:
+            with self.session.usingProfile(profile):
+                return list(
+                    self._streamResources(
+                        cacheKey, new_resource, service, operation, botoFuncOpts, region, variant, keepInMemory
+                    )
+                )
+
+        with ThreadPoolExecutor(max_workers=min(self._maxFetchWorkers, len(targets))) as executor:
+            futures = {executor.submit(fetchRegion, profile, region): (profile, region) for profile, region in targets}
+            for f in as_completed(futures):
+                try:
+                    fetched = f.result()
+                except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                    self._targetFailed(futures[f], e, failed)
+                    continue
+                yield from fetched
+
+    def _fetchRegion(self, fetched: Iterator[_resource], target: tuple, failed: set) -> Iterator[_resource]:
+        """pass a single target's resources through, reporting a failure as _fetchRegions does"""
+        try:
+            yield from fetched
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            self._targetFailed(target, e, failed)
+
+    def _targetFailed(self, target: tuple, e: Exception, failed: set) -> None:
+        """report a (profile, region) target's fetch failure. print() exits non-zero once output is complete."""
+        profile, region = target
+        print(f"error: fetching from {region} with profile {profile or 'default'}: {e}", file=sys.stderr)
+        failed.add(target)
+        self._failedTargets.add(target)
+
+    def _targets(self, **kwargs) -> list:
+        """(profile, region) pairs to fetch from, interleaved so concurrent fetches are spread across accounts"""
+        byProfile = []
+        for profile in self.session.profiles:
+            with self.session.usingProfile(profile):
+                regions = [kwargs["region"]] if "region" in kwargs else self.session.regions
+            byProfile.append([(profile, region) for region in regions])
+        return [t for ts in itertools.zip_longest(*byProfile) for t in ts if t]
+
+    def _clientFilter(self, filter: dict):
+        """a check of describe data for filters the describe call can't apply exactly (None if there are none)"""
+        return None
+
+    def _filterOpts(self, filter: dict) -> dict:
+        """map a filter spec onto EC2 request options. Supported keys are 'id', 'name' (prefix), 'vpc-id',
+        'tag:<key>' and any native filter name for the describe call."""
+        opts = {}
+        filters = []
+        for key, values in filter.items():
+            values = [values] if isinstance(values, str) else list(values)
+            if not values:
+                print(f"filter '{key}' needs at least one value", file=sys.stderr)
+                exit(1)
+            if key == "id":  # a filter rather than the ids parameter, which fails if any id doesn't exist
+                if not self._idFilter:
+                    print(f"{self.__class__.__name__} can not be filtered by id", file=sys.stderr)
+                    exit(1)
+                filters.append({"Name": self._idFilter, "Values": values})
+            elif key == "name":
+                filters.append({"Name": self._filterNames["name"], "Values": [f"{v}*" for v in values]})
+            else:
+                filters.append({"Name": self._filterNames.get(key, key), "Values": values})
+        if filters:
+            opts[self._filtersParam] = filters
+        return opts
+
+    def _fetch(
+        self,
+        cacheKey: str,
+        new_resource: _resource,
+        service: str,
+        operation: str,
+        botoFuncOpts: dict = {},
+        filter: dict = {},
+        **kwargs,
+    ) -> Self:
+        """queue a (lazy) fetch of all pages of `operation`. Resources are added as the collection is consumed.
+        Filtered results are cached separately from the full result set. Fetching again merges the results
+        into the collection (see delta) rather than adding everything a second time.
+
+        projected=True (or a list of fields) stores compact records holding only what print() displays (or
+        the listed fields) instead of full resources. It's ignored for JSON output, which needs everything.
+        fresh=True ignores (and replaces) cached data."""
+        targets = self._targets(**kwargs)
+        self._regions.update(region for _, region in targets)
+        self._profiles.update(profile for profile, _ in targets)
+        self._generation = self._resourceCache.generation
+        self._delta = fetchDelta()
+        botoFuncOpts = {**botoFuncOpts, **self._filterOpts(filter)}
+        variant = _filterVariant(filter)
+        self._resourceClass = new_resource
+        match = self._clientFilter(filter)
+        if match:
+            self._clientFilters[variant] = match
+        if "fresh" in kwargs and kwargs["fresh"]:
+            for profile, region in targets:
+                with self.session.usingProfile(profile):
+                    self._resourceCache.expire(region, variant)
+        projection = self._projection(new_resource, kwargs["projected"] if "projected" in kwargs else False)
+        if projection:
+            resourceClass = new_resource
+            new_resource = lambda **kw: projection.record(resourceClass(**kw))  # noqa: E731
+        failed = set()  # targets which failed are left out of merge's removals
+        if len(targets) > 1:
+            fetched = self._fetchRegions(
+                cacheKey, new_resource, service, operation, botoFuncOpts, targets, variant, not projection, failed
+            )
+        else:  # the current profile
+            self._region = targets[0][1]
+            fetched = self._streamResources(
+                cacheKey, new_resource, service, operation, botoFuncOpts, self.region, variant, not projection
+            )
+            fetched = self._fetchRegion(fetched, targets[0], failed)
+        fetched = self._merge(fetched, {(profile, region, variant) for profile, region in targets}, failed)
+        self._pending = fetched if self._pending is None else itertools.chain(self._pending, fetched)
         return self
 
+    def _projection(self, resourceClass: type, projected) -> Optional[_projection]:
+        if not projected:
+            return None
+        if projected is True:
+            if self.options.args.output_format in [cOptions.outputFormat.JSON, cOptions.outputFormat.NDJSON]:
+                return None
+            projected = resourceClass.displayFields(self.options.args.columns)[0]
+        return _projection(resourceClass, self.__class__, projected)
+
+    def _hydrate(self, id: str, region: Optional[str]) -> Optional[_resource]:
+        """describe one resource in full (for compact records). It isn't cached: every id would be a filter
+        variant (and disk cache file) of its own which nothing reads again."""
+        if not id:
+            return None
+        self._resourceCache = resourceCache(self.__class__.__name__, ttl=self._cacheTTL, enabled=False)
+        return next(iter(self.fetch(filter={"id": [id]}, region=region)), None)
+
+    @property
+    def isMultiRegion(self) -> bool:
+        return len(self._regions) > 1
+
+    @property
+    def isMultiAccount(self) -> bool:
+        return len(self._profiles) > 1
+
     @abstractmethod
     def fetch(self, filter: dict = {}, **kwargs) -> Self:
         pass
 
+    def _lookup(self, nameOrId: str) -> list:
+        """resources whose id or name match. Pending resources are only pulled in until a unique match is found."""
+        while True:
+            if nameOrId in self._byId:
+                return [self._byId[nameOrId]]
+            if self._uniqueNames and nameOrId in self._byName:
+                return list(self._byName[nameOrId])
+            if not self._nextPending():
+                return list(self._byName.get(nameOrId, []))
+
     def findOne(self, nameOrIdToFind: str) -> Optional[_resource]:
-        resourceL = [r for r in self._resourcesList if r.id == nameOrIdToFind or r.name == nameOrIdToFind]
+        resourceL = self._lookup(nameOrIdToFind)
         if len(resourceL) > 1:
             print(f"warn: findOne() returned {len(resourceL)} resources matching '{nameOrIdToFind}'", file=sys.stderr)
         elif not len(resourceL):
@@ -326,13 +1082,32 @@ class _resources(ABC):
             exit(1)
         return resourceL[0] if len(resourceL) > 0 else None
 
+    def findByPrefix(self, prefix: str) -> list:
+        """resources whose names start with prefix (eg. 'services/foo/prod/'), sorted by name"""
+        self._consumePending()
+        if self._sortedNames is None:
+            self._sortedNames = sorted(self._byName)
+        found = []
+        for name in itertools.islice(self._sortedNames, bisect.bisect_left(self._sortedNames, prefix), None):
+            if not name.startswith(prefix):
+                break
+            found += self._byName[name]
+        return found
+
+    @property
+    def isStale(self) -> bool:
+        """True if resources of this type have been changed (and the cache patched) since this collection
+        was fetched. Fetch again to see the changes."""
+        return self._resourceCache.generation != self._generation
+
     @property
     def isEmpty(self) -> bool:
-        return bool(not len(self._resourcesList))
+        return next(iter(self), None) is None
 
     @property
     def resourceIdsByName(self) -> dict:
-        return {r.name: r.id for r in self._resourcesList if r.name}
+        self._consumePending()
+        return {name: resourceL[-1].id for name, resourceL in self._byName.items() if resourceL[-1].id}
 
     @property
     def region(self) -> Optional[str]:
@@ -341,25 +1116,141 @@ class _resources(ABC):
     def get_region(self, **kwargs) -> Optional[str]:
         return kwargs["region"] if "region" in kwargs else self.session.default_region
 
+    def _displayFields(self, r: _resource | type, columns: list = []) -> tuple:
+        """display fields and their properties, adding region and account columns for multi-region and
+        multi-account collections"""
+        fields, fieldProps = r.displayFields(columns)
+        if self.isMultiRegion and "region" not in fields:
+            fields, fieldProps = ["region"] + fields, {**fieldProps, "region": {"width": 14}}
+        if self.isMultiAccount and "account" not in fields:
+            fields, fieldProps = ["account"] + fields, {**fieldProps, "account": {"width": 12}}
+        return fields, fieldProps
+
+    def _sortKey(self, r: _resource) -> str:
+        return f"{r.account if self.isMultiAccount else ''} {r.region if self.isMultiRegion else ''} {r.name} {r.id}"
+
+    def _record(self, r: _resource) -> dict:
+        """describe data for JSON output, with its region and account in multi-region/account collections"""
+        if not self.isMultiRegion and not self.isMultiAccount:
+            return r._describeData
+        return {
+            **r._describeData,
+            **({"Region": r.region} if self.isMultiRegion else {}),
+            **({"Account": r.account} if self.isMultiAccount else {}),
+        }
+
+    def watch(self, interval: float = 10, maxInterval: Optional[float] = None, **fetchKwargs) -> None:
+        """Print the collection then poll AWS every interval seconds, printing only the resources which were
+        added, removed or changed (see delta). Polls back off up to maxInterval (default 8 x interval) while
+        nothing changes. Runs until interrupted. fetchKwargs are passed to fetch() (eg. filter, projected)."""
+        maxInterval = maxInterval or interval * 8
+        output = self.options.args.output_format
+        delimited = output in [cOptions.outputFormat.CSV, cOptions.outputFormat.TSV]
+        try:
+            len(self.fetch(**fetchKwargs))  # print() streams unsorted output without keeping it
+            if output == cOptions.outputFormat.TEXT:
+                self._print()  # watching carries on when a target fails (print() would exit)
+            else:
+                self._printDelta(self.delta, header=delimited and self.options.args.header)
+            wait = interval
+            while True:
+                time.sleep(wait)
+                delta = self._poll(**fetchKwargs)
+                if delta:
+                    self._printDelta(delta)
+                    wait = interval
+                else:
+                    wait = min(wait * self._watchBackoff, maxInterval)
+                    if self.options.args.debug and delta is not None:
+                        print(f"debug: no changes, next poll in {wait:.0f}s", file=sys.stderr)
+        except KeyboardInterrupt:
+            print(file=sys.stderr)
+
+    def _poll(self, **fetchKwargs) -> Optional[fetchDelta]:
+        """fetch again for watch(). A failed poll (throttled, expired credentials, network, ...) is reported
+        and returns None so watching carries on."""
+        try:
+            return self.fetch(fresh=True, **fetchKwargs).delta
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            print(f"poll failed: {e}", file=sys.stderr)
+            self._pending = None  # the failed fetch's generator is finished
+            return None
+
+    def _printDelta(self, delta: fetchDelta, header: bool = False) -> None:
+        """print changed resources marked + (added), - (removed) or ~ (changed). JSON output is a stream of
+        describe data with a Change key and delimited output has a leading change column."""
+        output = self.options.args.output_format
+        changes = sorted(
+            [("added", r) for r in delta.added]
+            + [("changed", r) for r in delta.changed]
+            + [("removed", r) for r in delta.removed],
+            key=lambda x: self._sortKey(x[1]),
+        )
+        if output in [cOptions.outputFormat.JSON, cOptions.outputFormat.NDJSON]:
+            cUtils.dumpJsonStream(({"Change": c, "Region": r.region, **self._record(r)} for c, r in changes), ndjson=True)
+            return
+        if not changes:
+            return
+        fields, fieldProps = self._displayFields(changes[0][1], self.options.args.columns)
+        renderer = _newRenderer(output, fields, fieldProps, truncate=self.options.args.truncate)
+        if output != cOptions.outputFormat.TEXT:
+            if header:
+                renderer.write([("change", *fields)])
+            renderer.write((c, *renderer.values(r)) for c, r in changes)
+            return
+        counts = {c: sum(1 for x in changes if x[0] == c) for c in ["added", "changed", "removed"]}
+        print(f"\n{time.strftime('%H:%M:%S')} " + ", ".join(f"{n} {c}" for c, n in counts.items() if n))
+        for c, r in changes:
+            marker, color = self._watchMarkers[c]
+            line = f"{marker} {renderer.line(renderer.values(r))}"
+            print(f"\033[{color}m{line}\033[0m" if sys.stdout.isatty() else line)
+        sys.stdout.flush()
+
     def print(self, **kwargs) -> None:
+        """print the collection. Includes the time to fetch resources unless they've already been consumed.
+        Exits non-zero after printing if fetching from any (profile, region) target failed."""
+        with telemetry.span("print", resources=self.__class__.__name__):
+            self._print(**kwargs)
+        if self._failedTargets:
+            exit(1)
+
+    def _print(self, **kwargs) -> None:
         output = kwargs["output"] if "output" in kwargs else self.options.args.output_format
         truncate = kwargs["truncate"] if "truncate" in kwargs else self.options.args.truncate
         header = kwargs["header"] if "header" in kwargs else self.options.args.header
-        if not len(self._resourcesList):
-            print("no data")
+        columns = kwargs["columns"] if "columns" in kwargs else self.options.args.columns
+        compact = kwargs["compact"] if "compact" in kwargs else self.options.args.compact
+        jsonStream = output == cOptions.outputFormat.NDJSON or (output == cOptions.outputFormat.JSON and compact)
+        streamed = jsonStream or output in [cOptions.outputFormat.CSV, cOptions.outputFormat.TSV]  # don't sort
+        sort = kwargs["sort"] if "sort" in kwargs else self.options.args.sort and not streamed
+        autoFit = kwargs["autoFit"] if "autoFit" in kwargs else self.options.args.auto_fit and not streamed
+        resources = iter(sorted(self, key=self._sortKey) if sort else self.stream())
+        if jsonStream:
+            cUtils.dumpJsonStream(
+                (self._record(r) for r in resources),
+                ndjson=output == cOptions.outputFormat.NDJSON,
+            )  # bad - private vars
             return
-        d = []
-        r: _resource
-        for r in sorted(self._resourcesList, key=lambda x: f"{x.name} {x.id}", reverse=False):
-            if header and output == cOptions.outputFormat.TEXT:
-                _printTableHeader(r._displayFieldOrder, r._displayFieldProps)  # bad - private vars
-                header = False
-            if output == cOptions.outputFormat.JSON:
-                d.append(r._describeData)  # bad - private vars
-            else:
-                r.print(truncate=truncate, header=False, output=output)
         if output == cOptions.outputFormat.JSON:
-            cUtils.dumpJson(d)
+            cUtils.dumpJson([self._record(r) for r in resources])  # bad - private vars
+            return
+        first = next(resources, None)
+        if first is None and output == cOptions.outputFormat.TEXT:
+            print("no data", file=sys.stderr)  # keep stdout for data
+            return
+        if first is None and not (header and self._resourceClass):
+            return
+        renderer = _newRenderer(
+            output, *self._displayFields(self._resourceClass if first is None else first, columns), truncate=truncate
+        )  # an empty CSV/TSV result is just the header
+        resources = resources if first is None else itertools.chain([first], resources)
+        rows = (renderer.values(r) for r in resources)
+        if autoFit:
+            rows = list(rows)
+            renderer.autoFit(rows)
+        if header:
+            renderer.header()
+        renderer.write(rows)
 
 
 # ------------------------------------------------------------------------------------------------
@@ -540,6 +1431,7 @@ class security_group(_resource):
     resourceType = resourceType.SECURITY_GROUP
     _displayFieldOrder = ["name", "sgId", "desc"]
     _displayFieldProps = {"desc": {"width": 50}, "name": {"width": 25}, "sgId": {"width": 20}}
+    _dumpFields = _resource._dumpFields + ["sgId", "desc"]
 
     @property
     def id(self) -> Optional[str]:
@@ -571,13 +1463,17 @@ class security_group(_resource):
 
 
 class security_groups(_resources):
+    _idFilter = "group-id"
+    _filterNames = {"name": "group-name"}
 
     def fetch(self, filter={}, **kwargs) -> Self:
         return self._fetch(
             "SecurityGroups",
             security_group,
-            self.session.client("ec2", self.get_region(**kwargs)).describe_security_groups,
+            "ec2",
+            "describe_security_groups",
             {},
+            filter=filter,
             **kwargs,
         )
 
@@ -586,6 +1482,7 @@ class eip(_resource):
     resourceType = resourceType.EIP
     _displayFieldOrder = ["name", "id", "eip"]
     _displayFieldProps = {"name": {"width": 30}, "eip": {"width": 15}, "id": {"width": 26}}
+    _dumpFields = _resource._dumpFields + ["allocationId", "eip"]
 
     @property
     def id(self) -> Optional[str]:
@@ -613,13 +1510,16 @@ class eip(_resource):
 
 
 class eips(_resources):
+    _idFilter = "allocation-id"
 
     def fetch(self, filter={}, **kwargs) -> Self:
         return self._fetch(
             "Addresses",
             eip,
-            self.session.client("ec2", self.get_region(**kwargs)).describe_addresses,
+            "ec2",
+            "describe_addresses",
             {},
+            filter=filter,
             **kwargs,
         )
 
@@ -631,6 +1531,7 @@ class natgw(_resource):
     resourceType = resourceType.NATGW
     _displayFieldOrder = ["name", "natGwId"]
     _displayFieldProps = {"name": {"width": 30}, "natGwId": {"width": 24}}
+    _dumpFields = _resource._dumpFields + ["natGwId"]
 
     @property
     def id(self) -> Optional[str]:
@@ -654,13 +1555,17 @@ class natgw(_resource):
 
 
 class natgws(_resources):
+    _idFilter = "nat-gateway-id"
+    _filtersParam = "Filter"
 
     def fetch(self, filter={}, **kwargs) -> Self:
         return self._fetch(
             "NatGateways",
             natgw,
-            self.session.client("ec2", self.get_region(**kwargs)).describe_nat_gateways,
+            "ec2",
+            "describe_nat_gateways",
             {},
+            filter=filter,
             **kwargs,
         )
 
@@ -669,6 +1574,7 @@ class igw(_resource):
     resourceType = resourceType.IGW
     _displayFieldOrder = ["name", "igwId"]
     _displayFieldProps = {"name": {"width": 30}, "igwId": {"width": 24}}
+    _dumpFields = _resource._dumpFields + ["igwId"]
 
     @property
     def id(self) -> Optional[str]:
@@ -692,13 +1598,17 @@ class igw(_resource):
 
 
 class igws(_resources):
+    _idFilter = "internet-gateway-id"
+    _filterNames = {"name": "tag:Name", "vpc-id": "attachment.vpc-id"}
 
     def fetch(self, filter={}, **kwargs) -> Self:
         return self._fetch(
             "InternetGateways",
             igw,
-            self.session.client("ec2", self.get_region(**kwargs)).describe_internet_gateways,
+            "ec2",
+            "describe_internet_gateways",
             {},
+            filter=filter,
             **kwargs,
         )
 
@@ -707,6 +1617,7 @@ class route_table(_resource):
     resourceType = resourceType.ROUTE_TABLE
     _displayFieldOrder = ["name", "routeTableId"]
     _displayFieldProps = {"name": {"width": 30}, "routeTableId": {"width": 24}}
+    _dumpFields = _resource._dumpFields + ["routeTableId"]
 
     @property
     def id(self) -> Optional[str]:
@@ -730,13 +1641,16 @@ class route_table(_resource):
 
 
 class route_tables(_resources):
+    _idFilter = "route-table-id"
 
     def fetch(self, filter={}, **kwargs) -> Self:
         return self._fetch(
             "RouteTables",
             route_table,
-            self.session.client("ec2", self.get_region(**kwargs)).describe_route_tables,
+            "ec2",
+            "describe_route_tables",
             {},
+            filter=filter,
             **kwargs,
         )
 
@@ -745,6 +1659,7 @@ class subnet(_resource):
     resourceType = resourceType.SUBNET
     _displayFieldOrder = ["name", "subnetId"]
     _displayFieldProps = {"name": {"width": 30}, "subnetId": {"width": 24}}
+    _dumpFields = _resource._dumpFields + ["subnetId"]
 
     @property
     def id(self) -> Optional[str]:
@@ -768,17 +1683,17 @@ class subnet(_resource):
 
 
 class subnets(_resources):
+    _idFilter = "subnet-id"
 
     def fetch(self, filter={}, **kwargs) -> Self:
-        return self._fetch(
-            "Subnets", subnet, self.session.client("ec2", self.get_region(**kwargs)).describe_subnets, {}, **kwargs
-        )
+        return self._fetch("Subnets", subnet, "ec2", "describe_subnets", {}, filter=filter, **kwargs)
 
 
 class vpc(_resource):
     resourceType = resourceType.VPC
     _displayFieldOrder = ["name", "vpcId", "cidrBlock"]
     _displayFieldProps = {"cidrBlock": {"width": 18}, "name": {"width": 25}, "vpcId": {"width": 21}}
+    _dumpFields = _resource._dumpFields + ["vpcId", "cidrBlock"]
 
     @property
     def id(self) -> Optional[str]:
@@ -812,9 +1727,10 @@ class vpc(_resource):
 
 
 class vpcs(_resources):
+    _idFilter = "vpc-id"
 
     def fetch(self, filter={}, **kwargs) -> Self:
-        return self._fetch("Vpcs", vpc, self.session.client("ec2", self.get_region(**kwargs)).describe_vpcs, {}, **kwargs)
+        return self._fetch("Vpcs", vpc, "ec2", "describe_vpcs", {}, filter=filter, **kwargs)
 
 
 # ---------------------------
@@ -831,6 +1747,10 @@ class secret(_resource):
     _displayFieldOrder = ["name", "uniq", "last_changed", "desc"]
     _displayFieldProps = {"name": {"width": 65}, "uniq": {"width": 6}, "desc": {"width": 65}, "last_changed": {"width": 23}}
     _props = {"name": str, "desc": str, "value": str, "type": secretType}
+    _keyFields = ["id", "name", "arn"]
+    _dumpFields = _resource._dumpFields + ["arn", "desc", "uniq", "last_changed"]
+    _expensiveDumpFields = ["details", "valueDetails", "value"]
+    _secretCache = secretCache()
 
     @property
     def id(self) -> Optional[str]:
@@ -858,15 +1778,16 @@ class secret(_resource):
         if not props.get("name"):
             print("name required to create a secret", file=sys.stderr)
             return False
+        client = self.session.client("secretsmanager", self.region)
         try:
-            response = self.session.client("secretsmanager", self.region).describe_secret(SecretId=props["name"])
+            response = self.session.call(client, "describe_secret", SecretId=props["name"])
             if _checkHttpResponse(response):
                 print("Secret is pre-existing")
                 self._exists = True
-                self._describeData = response
-                self._details = None
+                self._secretCache.putDetails(response, self.region)
+                self._describeData = {k: v for k, v in response.items() if k != "ResponseMetadata"}
                 self._newData.update(props)
-        except self.session.client("secretsmanager", self.region).exceptions.ResourceNotFoundException:
+        except client.exceptions.ResourceNotFoundException:
             # If the secret doesn't exist, that's fine for creating a new one
             print(f"Secret '{props['name']}' does not exist yet, will create a new one")
         except Exception as e:
@@ -874,13 +1795,20 @@ class secret(_resource):
             exit(1)
         return True
 
+    def _patchCache(self, remove: bool = False) -> Self:
+        """write this secret's describe data through to the cached secrets listing"""
+        resourceCache(secrets.__name__, ttl=secrets._cacheTTL).patch(
+            self.region, "ARN", self.arn, None if remove else self._describeData
+        )
+        return self
+
     def refresh(self, **kwargs) -> Self:
-        if hasattr(self, "_describeData"):
-            self._details = None
-            self._describeData = self.details
-        if hasattr(self, "__secret_value"):
-            self.__secret_value = None
-            self.value
+        """forget cached describe data and values then describe the secret again"""
+        if self.arn:
+            self._secretCache.invalidate(self.arn)
+            details = self.details
+            if details:
+                self._describeData = {k: v for k, v in details.items() if k != "ResponseMetadata"}
         return self
 
     def _validate(self, secretType: secretType, json_data: str) -> bool:
@@ -940,7 +1868,9 @@ class secret(_resource):
             # Update instead of create
             return self.update(**{**kwargs, "value": self._newData.get("value"), "desc": self._newData.get("desc")})
 
-        response = self.session.client("secretsmanager", self.region).create_secret(
+        response = self.session.call(
+            self.session.client("secretsmanager", self.region),
+            "create_secret",
             Name=self._newData["name"],
             Description=self._newData["desc"],
             SecretString=self._newData["value"],
@@ -948,20 +1878,23 @@ class secret(_resource):
                 {"Key": "Name", "Value": self._newData["name"]},
             ],
         )
-        if response.get("ResponseMetadata") != 200:
-            cUtils.dumpJson(response, outputStream=sys.stderr)
+        if not _checkHttpResponse(response):
             return None
         self._exists = True
-        return self.refresh()
+        self._describeData = {"ARN": response["ARN"], "Name": response["Name"]}
+        return self.refresh()._patchCache()
 
     def restore(self, name: str) -> bool:
-        response = self.session.client("secretsmanager", self.region).restore_secret(
-            SecretId=name,
-        )
+        response = self.session.call(self.session.client("secretsmanager", self.region), "restore_secret", SecretId=name)
         if not _checkHttpResponse(response):
             print("secret failed to restore", file=sys.stderr)
             return False
+        self._secretCache.invalidate(name, self.region)
         print(f"secret {name} restored")
+        self._describeData = {"ARN": response["ARN"], "Name": response["Name"]}
+        self._exists = True
+        self._defunct = False
+        self.refresh()._patchCache()
         return True
 
     def update(self, **kwargs) -> Optional[Self]:
@@ -969,75 +1902,224 @@ class secret(_resource):
             print("secret not yet created or is defunct", file=sys.stderr)
             return None
         if kwargs.get("value"):
-            response = self.session.client("secretsmanager", self.region).put_secret_value(
+            response = self.session.call(
+                self.session.client("secretsmanager", self.region),
+                "put_secret_value",
                 SecretId=self.arn,
                 SecretString=kwargs["value"],
             )
+            self._secretCache.invalidate(self.arn)
             if not _checkHttpResponse(response):
                 return None
             print(f"stored version {response['VersionId']}")
         if kwargs.get("desc"):
-            response = self.session.client("secretsmanager", self.region).update_secret(
+            response = self.session.call(
+                self.session.client("secretsmanager", self.region),
+                "update_secret",
                 SecretId=self.arn,
                 Description=kwargs["desc"],
             )
             # cUtils.dumpJson(response)
+            self._secretCache.invalidate(self.arn)
             if not _checkHttpResponse(response):
                 return None
-        return self.refresh()
+        return self.refresh()._patchCache()
 
     def destroy(self) -> bool:
         if not self.exists or self.isDefunct:
             print("secret not yet created or is defunct", file=sys.stderr)
             return False
-        response = self.session.client("secretsmanager", self.region).delete_secret(
-            SecretId=self.arn, RecoveryWindowInDays=7
+        response = self.session.call(
+            self.session.client("secretsmanager", self.region), "delete_secret", SecretId=self.arn, RecoveryWindowInDays=7
         )
+        self._secretCache.invalidate(self.arn)
         print(f"DeletionDate: {response['DeletionDate']}")
+        self._patchCache(remove=True)  # listings exclude secrets scheduled for deletion
         self._exists = False
         self._defunct = True
         return True
 
     @property
     def details(self) -> dict:
-        if not hasattr(self, "_details"):
-            response = self.session.client("secretsmanager", self.region).describe_secret(SecretId=self.arn)
+        details = self._secretCache.details(self.arn)
+        if details is None:
+            response = self.session.call(
+                self.session.client("secretsmanager", self.region), "describe_secret", SecretId=self.arn
+            )
             if not _checkHttpResponse(response):
                 return {}
-            self._details = response
-        return self._details
-
-    @property
-    def _value(self) -> dict:
-        if not hasattr(self, "__secret_value"):
-            response = self.session.client("secretsmanager", self.region).get_secret_value(SecretId=self.arn)
+            self._secretCache.putDetails(response, self.region)
+            details = response
+        return details
+
+    def versionValueDetails(self, versionStage: str = "AWSCURRENT", versionId: Optional[str] = None) -> dict:
+        """get_secret_value response for a version, by stage (AWSCURRENT, AWSPREVIOUS, ...) or id"""
+        valueDetails = self._secretCache.value(self.arn, versionId=versionId, versionStage=versionStage)
+        if valueDetails is None:
+            versionOpts = {"VersionId": versionId} if versionId else {"VersionStage": versionStage}
+            response = self.session.call(
+                self.session.client("secretsmanager", self.region), "get_secret_value", SecretId=self.arn, **versionOpts
+            )
             if not _checkHttpResponse(response):
                 return {}
-            self.__secret_value = response
-        return self.__secret_value
+            self._secretCache.putValue(response, self.region)
+            valueDetails = response
+        return valueDetails
+
+    def versionValue(self, versionStage: str = "AWSCURRENT", versionId: Optional[str] = None) -> str:
+        return self.versionValueDetails(versionStage, versionId)["SecretString"]
 
     @property
     def value(self) -> str:
-        return self._value["SecretString"]
+        return self.versionValue()
+
+    @property
+    def previousValue(self) -> str:
+        return self.versionValue("AWSPREVIOUS")
 
     @property
     def valueDetails(self) -> dict:
-        return self._value
+        return self.versionValueDetails()
 
 
 class secrets(_resources):
+    _cacheTTL = 60
+    _uniqueNames = True
+    _batchSize = 20  # max secrets per BatchGetSecretValue call
+    _maxValueWorkers = 8  # concurrent GetSecretValue calls when batching isn't available
 
     def fetch(self, filter={}, **kwargs) -> Self:
         return self._fetch(
             "SecretList",
             secret,
-            self.session.client("secretsmanager", self.get_region(**kwargs)).list_secrets,
+            "secretsmanager",
+            "list_secrets",
             {"IncludePlannedDeletion": False, "SortOrder": "asc"},
+            filter=filter,
             **kwargs,
         )
 
+    def _filterOpts(self, filter: dict) -> dict:
+        """map a filter spec onto list_secrets filters. 'name' is a prefix match. 'tag:<key>' matches
+        the tag key and value(s). Other keys (eg. description, tag-key) are passed through."""
+        filters = []
+        for key, values in filter.items():
+            values = [values] if isinstance(values, str) else list(values)
+            if not values:
+                print(f"filter '{key}' needs at least one value", file=sys.stderr)
+                exit(1)
+            if key == "id":
+                print("secrets can not be filtered by id (use 'name' instead)", file=sys.stderr)
+                exit(1)
+            elif key.startswith("tag:"):  # prefilter, see _clientFilter()
+                filters.append({"Key": "tag-key", "Values": [key[4:]]})
+                filters.append({"Key": "tag-value", "Values": values})
+            else:
+                filters.append({"Key": key, "Values": values})
+        return {"Filters": filters} if filters else {}
+
+    def _clientFilter(self, filter: dict):
+        """list_secrets matches tag keys and values independently so tag:K=V also matches secrets with tag K
+        and some other tag with value V. Check tag K's value."""
+        tagFilters = {k[4:]: set([v] if isinstance(v, str) else v) for k, v in filter.items() if k.startswith("tag:")}
+        if not tagFilters:
+            return None
+
+        def match(describeData: dict) -> bool:
+            tags = _parseTagList(describeData.get("Tags") or [])
+            return all(tags.get(k) in values for k, values in tagFilters.items())
+
+        return match
+
+    def _hydrate(self, id: str, region: Optional[str]) -> Optional[_resource]:
+        return self.get(id, region=region) if id else None
+
+    def get(self, nameOrArn: str, **kwargs) -> Optional[secret]:
+        """Look up one secret by name or ARN with describe_secret. Only partial names (or secrets
+        pending deletion) fall back to listing all secrets and searching them with findOne()."""
+        region = self.get_region(**kwargs)
+        client = self.session.client("secretsmanager", region)
+        try:
+            response = self.session.call(client, "describe_secret", SecretId=nameOrArn)
+        except client.exceptions.ResourceNotFoundException:
+            response = None
+        if not response or not _checkHttpResponse(response) or response.get("DeletedDate"):
+            return self.fetch(**kwargs).findOne(nameOrArn)
+        secret._secretCache.putDetails(response, region)  # saves describing it again
+        return secret(_describeData={k: v for k, v in response.items() if k != "ResponseMetadata"}, region=region)
+
+    def _batchGetValues(self, client, **batchOpts) -> Iterator[dict]:
+        """yield secret values from batch_get_secret_value, following NextToken"""
+        while True:
+            response = self.session.call(client, "batch_get_secret_value", **batchOpts)
+            if not _checkHttpResponse(response):
+                return
+            for e in response.get("Errors") or []:
+                print(f"error: {e.get('SecretId')}: {e.get('ErrorCode')} {e.get('Message')}", file=sys.stderr)
+            yield from response.get("SecretValues") or []
+            if not response.get("NextToken"):
+                return
+            batchOpts["NextToken"] = response["NextToken"]
+
+    def _getValues(self, client, names: list) -> Iterator[dict]:
+        """yield secret values using concurrent get_secret_value calls"""
+
+        def getValue(name: str) -> Optional[dict]:
+            try:
+                response = self.session.call(client, "get_secret_value", SecretId=name)
+            except client.exceptions.ResourceNotFoundException:
+                print(f"error: {name}: secret not found", file=sys.stderr)
+                return None
+            return response if _checkHttpResponse(response) else None
+
+        with ThreadPoolExecutor(max_workers=min(self._maxValueWorkers, len(names) or 1)) as executor:
+            yield from [v for v in executor.map(getValue, names) if v]
+
+    def _batchReadValues(self, client, names: list, prefix: Optional[str]) -> dict:
+        values = {}
+        for start in range(0, len(names), self._batchSize):
+            end = start + self._batchSize
+            for v in self._batchGetValues(client, SecretIdList=names[start:end]):
+                values[v["Name"]] = v
+        if prefix:
+            for v in self._batchGetValues(client, Filters=[{"Key": "name", "Values": [prefix]}], MaxResults=self._batchSize):
+                if v["Name"].startswith(prefix):  # name filters are not case-sensitive
+                    values[v["Name"]] = v
+        return values
+
+    def readValues(self, names: list = [], prefix: Optional[str] = None, **kwargs) -> dict:
+        """Read many secret values at once, by name/ARN and/or name prefix, using BatchGetSecretValue
+        (20 secrets per call). Falls back to concurrent GetSecretValue calls if the batch API isn't
+        available or allowed. Returns {name: get_secret_value response}. Values this process has
+        already read (current versions) are not read again."""
+        region = self.get_region(**kwargs)
+        cached = {n: secret._secretCache.value(n, region) for n in names}
+        values = {v["Name"]: v for v in cached.values() if v}
+        names = [n for n in names if not cached[n]]
+        if names or prefix:
+            values.update(self._readValues(region, names, prefix, **kwargs))
+        return values
+
+    def _readValues(self, region: str, names: list, prefix: Optional[str], **kwargs) -> dict:
+        client = self.session.client("secretsmanager", region)
+        try:
+            values = self._batchReadValues(client, names, prefix)
+        except (AttributeError, botocore.exceptions.ClientError) as e:
+            if isinstance(e, botocore.exceptions.ClientError) and e.response["Error"]["Code"] != "AccessDeniedException":
+                raise
+            if self.options.args.debug:
+                print(f"debug: BatchGetSecretValue unavailable ({e}), using GetSecretValue", file=sys.stderr)
+            if prefix:
+                names = names + [r.arn for r in self.fetch(filter={"name": [prefix]}, **kwargs).findByPrefix(prefix)]
+            values = {v["Name"]: v for v in self._getValues(client, names)}
+        for v in values.values():
+            secret._secretCache.putValue(v, region)
+        return values
+
     def findOne(self, nameToFind: str) -> Optional[_resource]:
-        resourceL = [r for r in self._resourcesList if r.id == nameToFind or r.name == nameToFind or nameToFind in r.arn]
+        resourceL = self._lookup(nameToFind) or self.findByPrefix(nameToFind)
+        if not resourceL:  # last resort, partial names and arns
+            resourceL = [r for r in self._resourcesList if nameToFind in r.arn]
         if len(resourceL) > 1:
             print(f"warn: findOne() returned {len(resourceL)} resources matching '{nameToFind}'", file=sys.stderr)
         elif not len(resourceL):
@@ -1,24 +1,346 @@
+import os
 import sys
+import time
+import random
+import threading
 import boto3
+from contextlib import contextmanager
 from typing import Optional
 import boto3.session
+import botocore.session
+import botocore.credentials
+import botocore.exceptions
+import botocore.config
+from datetime import datetime, timezone
 import clamity.core.options as cOptions
+import clamity.core.cache as cCache
+import clamity.core.telemetry as telemetry
+
+_botoSessions = {}  # profile name (None for botocore's default) => boto3 session
+_clientPool = {}  # (profile, service, region) => boto3 client
+_clientPoolLock = threading.Lock()
+_dataLoader = None  # botocore loader shared by all sessions once service models are preloaded
+_credentialRefreshMargin = 15 * 60  # don't reuse cached credentials that expire sooner than this (seconds)
+
+# Throttling. Pooled clients use botocore's adaptive retry mode and share a token bucket per profile, service
+# and region which every request (including retries and paginated calls) draws from. Throttles which outlast
+# botocore's retries are retried again by sessionSettings.call() with exponential backoff and full jitter.
+_maxAttempts = 8  # botocore attempts per call
+_maxThrottleRetries = 4  # sessionSettings.call() retries once botocore gives up
+_backoffBase = 1.0  # seconds
+_backoffCap = 30.0
+_serviceRates = {  # (requests/sec, burst) - the published per account, per region request limits
+    "ec2": (20.0, 100),
+    "secretsmanager": (50.0, 100),
+}
+_defaultRate = (20.0, 50)
+_throttleCodes = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+}
+_callStats = {}  # (profile, service, region) => counters
+_accountIds = {}  # profile name => account id
+_threadState = threading.local()  # profile used by this thread (see sessionSettings.usingProfile)
+
+
+class _tokenBucket:
+    """Requests take a token, waiting for one if none are left. Tokens are replenished at rate/sec up to burst."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """take a token. Returns seconds spent waiting for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1  # reserve it now so waiting requests are served in order
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _isThrottle(e: Exception) -> bool:
+    return isinstance(e, botocore.exceptions.ClientError) and e.response.get("Error", {}).get("Code") in _throttleCodes
+
+
+def _instrumentClient(client, key: tuple) -> None:
+    """rate limit and count a pooled client's requests"""
+    bucket = _tokenBucket(*_serviceRates.get(key[1], _defaultRate))
+    stats = _callStats.setdefault(key, {"calls": 0, "requests": 0, "throttles": 0, "rateLimitWait": 0.0})
+    lock = threading.Lock()
+
+    def beforeCall(**kwargs):
+        with lock:
+            stats["calls"] += 1
+
+    def beforeSend(**kwargs):
+        wait = bucket.acquire()
+        with lock:
+            stats["requests"] += 1
+            stats["rateLimitWait"] += wait
+
+    def needsRetry(response=None, **kwargs):
+        if response and response[1].get("Error", {}).get("Code") in _throttleCodes:
+            with lock:
+                stats["throttles"] += 1
+            telemetry.count("aws.throttled", service=key[1], region=key[2])
+
+    client.meta.events.register("before-call", beforeCall)
+    client.meta.events.register("before-send", beforeSend)
+    client.meta.events.register("needs-retry", needsRetry)
+    if telemetry.enabled():
+        _traceClient(client, key)
+
+
+def _traceClient(client, key: tuple) -> None:
+    """record each call's latency, retries, status and response size"""
+
+    def startCall(context: dict, **kwargs):
+        context["clamityStarted"] = time.perf_counter()
+
+    def endCall(http_response, parsed: dict, model, context: dict, **kwargs):
+        size = 0 if model.has_streaming_output else len(http_response.content or b"")
+        telemetry.apiCall(
+            key[1],
+            model.name,
+            key[2],
+            context.get("clamityStarted", time.perf_counter()),
+            http_response.status_code,
+            retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+            size=size,
+            error=parsed.get("Error", {}).get("Code"),
+        )
+
+    def callError(exception: Exception, context: dict, event_name: str, **kwargs):
+        started = context.get("clamityStarted", time.perf_counter())
+        telemetry.apiCall(key[1], event_name.split(".")[-1], key[2], started, None, error=type(exception).__name__)
+
+    client.meta.events.register("before-call", startCall)
+    client.meta.events.register("after-call", endCall)
+    client.meta.events.register("after-call-error", callError)
+
+
+def preloadServiceModels(services: list) -> None:
+    """Load the botocore models, endpoints and retry config services need so sessions created later,
+    such as in children of the fork server, don't read and parse them again."""
+    global _dataLoader
+    coreSession = botocore.session.get_session()
+    for service in services:
+        # creating a client loads everything it needs. No credentials are looked up or requests made.
+        coreSession.create_client(service, region_name="us-east-1", aws_access_key_id="-", aws_secret_access_key="-")
+    _dataLoader = coreSession.get_component("data_loader")
+
+
+class _cachedCredentialProvider(botocore.credentials.CredentialProvider):
+    """Shares temporary credentials (SSO, assumed roles, ...) between processes by caching them in
+    $CLAMITY_HOME/cache until shortly before they expire. Long lived credentials are never cached."""
+
+    METHOD = "clamity-cache"
+    CANONICAL_NAME = "clamity-cache"
+
+    def __init__(self, resolver: botocore.credentials.CredentialResolver, profile: str, useCache: bool = True) -> None:
+        self._resolver = resolver
+        self._useCache = useCache
+        self._diskCache = cCache.diskCache(["aws", profile, "credentials"], ttl=86400)
+
+    @staticmethod
+    def _secondsLeft(metadata: dict) -> float:
+        expires = datetime.fromisoformat(metadata["expiry_time"])
+        return (expires - datetime.now(timezone.utc)).total_seconds()
+
+    def _resolve(self) -> Optional[botocore.credentials.Credentials]:
+        """the credentials the rest of the chain would have found"""
+        for provider in self._resolver.providers:
+            if provider is not self:
+                creds = provider.load()
+                if creds is not None:
+                    return creds
+        return None
+
+    @staticmethod
+    def _metadata(creds: botocore.credentials.Credentials) -> Optional[dict]:
+        """None unless creds are temporary"""
+        frozen = creds.get_frozen_credentials()
+        expires = getattr(creds, "_expiry_time", None)
+        if not frozen.token or expires is None:
+            return None
+        return {
+            "access_key": frozen.access_key,
+            "secret_key": frozen.secret_key,
+            "token": frozen.token,
+            "expiry_time": expires.isoformat(),
+        }
+
+    def _cached(self) -> Optional[dict]:
+        cached = self._diskCache.load() if self._useCache else None
+        self._useCache = True  # --refresh only skips the cache once
+        return cached if cached and self._secondsLeft(cached) > _credentialRefreshMargin else None
+
+    def _refresh(self) -> dict:
+        metadata = self._cached()  # another process may have refreshed them
+        if metadata is None:
+            with telemetry.span("aws.credentials", refresh=True):
+                creds = self._resolve()
+            metadata = self._metadata(creds) if creds else None
+            if metadata is None:
+                raise botocore.exceptions.CredentialRetrievalError(
+                    provider=self.METHOD, error_msg="no temporary credentials"
+                )
+            self._diskCache.save(metadata)
+        return metadata
+
+    def load(self) -> Optional[botocore.credentials.Credentials]:
+        if not self._diskCache.enabled:
+            return None
+        metadata = self._cached()
+        if metadata is None:
+            with telemetry.span("aws.credentials"):
+                creds = self._resolve()
+            metadata = self._metadata(creds) if creds else None
+            if metadata is None:
+                return creds  # long lived credentials (or none at all) aren't cached
+            telemetry.count("cache.credentials.miss")
+            self._diskCache.save(metadata)
+        else:
+            telemetry.count("cache.credentials.hit")
+        return botocore.credentials.RefreshableCredentials.create_from_metadata(
+            metadata, refresh_using=self._refresh, method=self.METHOD
+        )
+
+
+def _newBotoSession(profile: Optional[str], useCache: bool = True) -> boto3.session.Session:
+    coreSession = botocore.session.Session(profile=profile)
+    if _dataLoader is not None:
+        coreSession.register_component("data_loader", _dataLoader)
+    # credentials from the environment are checked first; cached ones before anything that calls out
+    resolver = coreSession.get_component("credential_provider")
+    provider = _cachedCredentialProvider(resolver, profile or "default", useCache=useCache)
+    if "env" in [p.METHOD for p in resolver.providers]:
+        resolver.insert_after("env", provider)
+    else:  # botocore leaves the environment out of the chain when a profile is named
+        resolver.insert_before(resolver.providers[0].METHOD, provider)
+    return boto3.session.Session(botocore_session=coreSession)
 
 
 class sessionSettings(metaclass=cOptions.Singleton):
     options = cOptions.CmdOptions()
     _set_default_from_arg = False
+    _default_region = None
+
+    @property
+    def _profileArgs(self) -> list:
+        """--aws-profile p1,p2 => ['p1', 'p2']"""
+        return [p.strip() for p in (getattr(self.options.args, "aws_profile", None) or "").split(",") if p.strip()]
+
+    @property
+    def profileName(self) -> Optional[str]:
+        """the profile this thread uses, if one was named. None means botocore's default credential chain
+        (environment, instance role, ...) which needs no profile in the AWS config."""
+        if getattr(_threadState, "profile", None):
+            return _threadState.profile
+        if len(self._profileArgs) == 1 and self._profileArgs != ["all"]:
+            return self._profileArgs[0]
+        return os.environ.get("AWS_PROFILE")
+
+    @property
+    def profile(self) -> str:
+        """profileName for display ('default' when none was named)"""
+        return self.profileName or "default"
+
+    @property
+    def profiles(self) -> list:
+        """profiles requested with --aws-profile (a profile, comma separated list or 'all' profiles in the
+        AWS config), otherwise just the current one (None if no profile was named, see profileName)"""
+        if getattr(_threadState, "profile", None):
+            return [_threadState.profile]
+        if self._profileArgs == ["all"]:
+            return sorted(botocore.session.Session().available_profiles)
+        return self._profileArgs or [self.profileName]
+
+    @contextmanager
+    def usingProfile(self, profile: Optional[str]):
+        """use profile for this thread's sessions, clients and caches within the block. None (no named
+        profile) leaves the thread with botocore's default credential chain."""
+        if profile is None:
+            yield
+            return
+        previous = getattr(_threadState, "profile", None)
+        _threadState.profile = profile
+        try:
+            yield
+        finally:
+            _threadState.profile = previous
+
+    @property
+    def botoSession(self) -> boto3.session.Session:
+        """one boto3 session per profile. The process' default boto3 session is never touched."""
+        profile = self.profileName
+        with _clientPoolLock:
+            if profile not in _botoSessions:
+                _botoSessions[profile] = _newBotoSession(profile, useCache=not self.options.args.refresh)
+            return _botoSessions[profile]
+
+    @property
+    def accountId(self) -> Optional[str]:
+        """the profile's AWS account id (cached, on disk too for named profiles)"""
+        profile = self.profileName
+        if profile not in _accountIds:
+            accountCache = cCache.diskCache(["aws", profile, "account-id"], ttl=30 * 86400) if profile else None
+            accountId = None if self.options.args.refresh or not accountCache else accountCache.load()
+            if not accountId:
+                accountId = self.call(self.client("sts", self.default_region), "get_caller_identity").get("Account")
+                if accountCache:
+                    accountCache.save(accountId)
+            _accountIds[profile] = accountId
+        return _accountIds[profile]
+
+    @property
+    def _regionArgs(self) -> list:
+        """--aws-region us-east-1,us-west-2 => ['us-east-1', 'us-west-2']"""
+        return [r.strip() for r in (self.options.args.aws_region or "").split(",") if r.strip()]
 
     @property
     def default_region(self) -> Optional[str]:
-        if not self._set_default_from_arg and self.options.args.aws_region:
-            self.default_region = self.options.args.aws_region
+        if not self._set_default_from_arg and self._regionArgs and self._regionArgs[0] != "all":
+            self.default_region = self._regionArgs[0]
             self._set_default_from_arg = True
-        return boto3._get_default_session().region_name  # this should not be private
+        return self._default_region or self.botoSession.region_name
 
     @default_region.setter
     def default_region(self, region: str) -> None:
-        boto3.setup_default_session(region_name=region)
+        self._default_region = region
+
+    @property
+    def enabledRegions(self) -> list:
+        """all regions enabled for the account (cached for a day)"""
+        regionCache = cCache.diskCache(["aws", self.profile, "enabled-regions"], ttl=86400)
+        regions = None if self.options.args.refresh else regionCache.load()
+        if not regions:
+            response = self.client("ec2", self.default_region or "us-east-1").describe_regions()
+            regions = sorted([r["RegionName"] for r in response["Regions"]])
+            regionCache.save(regions)
+        return regions
+
+    @property
+    def regions(self) -> list:
+        """regions requested with --aws-region (a region, comma separated list or 'all')"""
+        if self._regionArgs == ["all"]:
+            return self.enabledRegions
+        return self._regionArgs or [self.default_region]
 
     def botoRequestOptions(self, **kwargs) -> dict:
         request_region = kwargs["region"] if "region" in kwargs else self.default_region
@@ -28,9 +350,46 @@ class sessionSettings(metaclass=cOptions.Singleton):
                 file=sys.stderr,
             )
             exit(1)
-        return {"region_name": request_region}
+        return {
+            "region_name": request_region,
+            "config": botocore.config.Config(
+                retries={"mode": os.environ.get("AWS_RETRY_MODE") or "adaptive", "max_attempts": _maxAttempts}
+            ),
+        }
 
     def client(self, client: str, region: str):
-        if region != self.default_region:
-            self.default_region = region
-        return boto3.client(client, **self.botoRequestOptions(region=region))
+        """returns a pooled client. Clients are thread safe; creating them is not so it's serialized."""
+        region = region or self.default_region
+        key = (self.profileName, client, region)
+        if key not in _clientPool:
+            botoSession = self.botoSession
+            requestOptions = self.botoRequestOptions(region=region)
+            with _clientPoolLock:
+                if key not in _clientPool:
+                    with telemetry.span("aws.client", service=client, region=region):
+                        c = botoSession.client(client, **requestOptions)
+                    _instrumentClient(c, key)
+                    _clientPool[key] = c
+        return _clientPool[key]
+
+    def call(self, client, operation: str, **kwargs) -> dict:
+        """Call a client operation. Throttling errors which outlast botocore's retries are retried with
+        exponential backoff and full jitter before giving up."""
+        for attempt in range(_maxThrottleRetries + 1):
+            try:
+                return getattr(client, operation)(**kwargs)
+            except botocore.exceptions.ClientError as e:
+                if not _isThrottle(e) or attempt == _maxThrottleRetries:
+                    raise
+                delay = random.uniform(0, min(_backoffCap, _backoffBase * 2**attempt))
+                if self.options.args.debug:
+                    print(
+                        f"debug: {operation} throttled in {client.meta.region_name}, retrying in {delay:.1f}s",
+                        file=sys.stderr,
+                    )
+                time.sleep(delay)
+
+    @property
+    def callStats(self) -> dict:
+        """request counters for all pooled clients: {(profile, service, region): {calls, requests, throttles, ...}}"""
+        return {k: dict(v) for k, v in _callStats.items()}
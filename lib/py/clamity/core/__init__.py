@@ -3,6 +3,13 @@
 Resources used by most, if not all, clamity python scripts.
 """
 
-from . import utils
-from . import options
-from . import variables
+import importlib
+
+# Modules are imported on first use to keep command start up fast.
+_modules = ["utils", "options", "variables", "cache", "importtime", "forkserver", "daemon", "telemetry"]
+
+
+def __getattr__(name: str):
+    if name in _modules:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,115 @@
+"""
+Persistent data cache
+
+Cached data is stored as JSON files beneath $CLAMITY_HOME/cache. Each entry is
+addressed by a list of key components (eg. ['aws', profile, region, 'vpcs'])
+which map to a directory path. Writes are atomic (temp file + rename) so
+concurrent clamity processes never see a partially written entry.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+from datetime import datetime, date
+from typing import Optional
+
+
+def cacheRoot() -> Optional[str]:
+    """returns the cache directory or None if $CLAMITY_HOME is not set"""
+    return os.path.join(os.environ["CLAMITY_HOME"], "cache") if os.environ.get("CLAMITY_HOME") else None
+
+
+def _jsonEncodeHandler(x):
+    if isinstance(x, datetime):
+        return {"__datetime__": x.isoformat()}
+    if isinstance(x, date):
+        return {"__date__": x.isoformat()}
+    return str(type(x))
+
+
+def _jsonDecodeHook(d: dict):
+    if "__datetime__" in d:
+        return datetime.fromisoformat(d["__datetime__"])
+    if "__date__" in d:
+        return date.fromisoformat(d["__date__"])
+    return d
+
+
+def _safeKey(k: str) -> str:
+    """make a key component safe for use as a file or directory name"""
+    return re.sub(r"[^A-Za-z0-9_.@-]", "_", str(k)) or "_"
+
+
+class diskCache:
+    """One cached object stored in a file. Entries older than ttl seconds are ignored."""
+
+    def __init__(self, keys: list, ttl: int = 300) -> None:
+        self._keys = [_safeKey(k) for k in keys]
+        self._ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return cacheRoot() is not None
+
+    @property
+    def path(self) -> Optional[str]:
+        if not self.enabled:
+            return None
+        return os.path.join(cacheRoot(), *self._keys[:-1], f"{self._keys[-1]}.json")
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl
+
+    def _loadEntry(self) -> Optional[dict]:
+        if not self.enabled or self._ttl <= 0:
+            return None
+        try:
+            with open(self.path, "r") as f:
+                entry = json.load(f, object_hook=_jsonDecodeHook)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created", 0) > self._ttl:
+            return None
+        return entry
+
+    def load(self) -> Optional[any]:
+        """returns the cached data or None if missing, expired or unreadable"""
+        entry = self._loadEntry()
+        return entry.get("data") if entry else None
+
+    def update(self, patch) -> bool:
+        """replace the cached data with patch(data). The entry keeps its creation time so patching
+        doesn't extend its life. False if nothing (unexpired) is cached."""
+        entry = self._loadEntry()
+        if entry is None:
+            return False
+        return self.save(patch(entry.get("data")), created=entry.get("created"))
+
+    def save(self, data: any, created: Optional[float] = None) -> bool:
+        """atomically replace the cached data"""
+        if not self.enabled:
+            return False
+        import tempfile  # not needed by most commands
+
+        cacheDir = os.path.dirname(self.path)
+        try:
+            os.makedirs(cacheDir, mode=0o700, exist_ok=True)
+            fd, tmpFile = tempfile.mkstemp(dir=cacheDir, prefix=".tmp-")  # created with mode 0600
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"created": created or time.time(), "data": data}, f, default=_jsonEncodeHandler)
+                os.replace(tmpFile, self.path)
+            except BaseException:
+                os.unlink(tmpFile)
+                raise
+        except OSError as e:
+            print(f"warn: could not write cache file {self.path}: {e}", file=sys.stderr)
+            return False
+        return True
+
+    def remove(self) -> None:
+        if self.enabled and os.path.exists(self.path):
+            os.unlink(self.path)
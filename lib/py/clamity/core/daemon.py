@@ -0,0 +1,51 @@
+"""
+Unix socket daemons
+
+Helpers shared by the long running clamity processes which serve requests over
+a unix socket (the python fork server and the secrets agent): binding a socket
+only the owner can reach, removing it on the way out and running the server in
+the background.
+"""
+
+import os
+import sys
+from typing import Callable
+
+
+def bindSocket(path: str, bind: Callable) -> any:
+    """call bind(), which creates the unix socket at path, so that only the owner can reach it. A stale
+    socket left by a server that didn't exit cleanly is removed first. Returns what bind() returns."""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    removeSocket(path)
+    oldUmask = os.umask(0o177)
+    try:
+        return bind()
+    finally:
+        os.umask(oldUmask)
+
+
+def removeSocket(path: str) -> None:
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def daemonize(serve: Callable, logFile: str = os.devnull) -> None:
+    """run serve() in a daemon (double forked in its own session with stdin from /dev/null and stdout and
+    stderr appended to logFile). Returns in the calling process once the daemon has been forked."""
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(os.devnull, "r") as devNull, open(logFile, "a") as log:
+        os.dup2(devNull.fileno(), 0)
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    try:
+        serve()
+    finally:
+        os._exit(0)
@@ -0,0 +1,306 @@
+"""
+Warm python command server
+
+Starting a clamity python command means starting an interpreter, importing
+boto3 and loading the botocore service models, which takes far longer than
+most commands spend doing their work. The fork server does that once and then
+forks a child for each command it's asked to run. The child gets the client's
+argv, environment, working directory and stdin/stdout/stderr (passed over the
+unix socket) so it behaves as if it had been run directly.
+
+It's opt-in (clamity config set default py_fork_server 1). When enabled,
+clam-py runs commands through the server, starting it on first use. Commands
+run locally whenever the server isn't available.
+
+usage:
+
+    python -m clamity.core.forkserver { start | stop | status | run }
+    python -m clamity.core.forkserver exec <script.py> [args...]
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import socket
+from typing import Optional
+import clamity.core.daemon as cDaemon
+
+# modules imported and service models loaded by the server before it forks
+preloadModules = ["clamity.core.options", "clamity.core.utils", "clamity.core.cache", "clamity.aws.resources"]
+preloadServices = ["ec2", "secretsmanager", "sts"]
+
+_maxFds = 3  # stdin, stdout, stderr
+
+
+def socketPath() -> Optional[str]:
+    if os.environ.get("CLAMITY_PY_FORKSERVER_SOCK"):
+        return os.environ["CLAMITY_PY_FORKSERVER_SOCK"]
+    if not os.environ.get("CLAMITY_HOME"):
+        return None
+    return os.path.join(os.environ["CLAMITY_HOME"], "run", "py-forkserver.sock")
+
+
+def _readLine(conn: socket.socket, data: bytes = b"") -> bytes:
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _send(conn: socket.socket, msg: dict, fds: list = []) -> None:
+    data = (json.dumps(msg) + "\n").encode()
+    if fds:
+        n = socket.send_fds(conn, [data], fds)
+        data = data[n:]
+    conn.sendall(data)
+
+
+class forkServerClient:
+    """Runs commands in, or otherwise talks to, a running fork server"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._path = path or socketPath()
+
+    def _connect(self) -> Optional[socket.socket]:
+        if not self._path or not os.path.exists(self._path) or os.stat(self._path).st_uid != os.getuid():
+            return None
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self._path)
+        except OSError:
+            s.close()
+            return None
+        return s
+
+    def request(self, op: str) -> Optional[dict]:
+        """send a control request (status, stop). Returns None if the server isn't running."""
+        s = self._connect()
+        if s is None:
+            return None
+        with s:
+            try:
+                _send(s, {"op": op})
+                return json.loads(_readLine(s) or b"null")
+            except (OSError, ValueError):
+                return None
+
+    @property
+    def isRunning(self) -> bool:
+        return self.request("status") is not None
+
+    def execute(self, argv: list) -> Optional[int]:
+        """run argv (script and args) in a forked child. Returns its exit code or None if the server isn't available."""
+        s = self._connect()
+        if s is None:
+            return None
+        with s:
+            try:
+                _send(s, {"op": "exec", "argv": argv, "env": dict(os.environ), "cwd": os.getcwd()}, [0, 1, 2])
+                response = json.loads(_readLine(s) or b"null")
+            except (OSError, ValueError):
+                return None
+            if not response or "pid" not in response:
+                return None  # server declined (eg. it's stale and shutting down)
+            return self._waitForExit(s, response["pid"])
+
+    def _waitForExit(self, s: socket.socket, pid: int) -> int:
+        # the child isn't in our process group so pass on signals meant for it
+        def forward(signum, frame):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT):
+            signal.signal(sig, forward)
+        try:
+            response = json.loads(_readLine(s) or b"null")
+        except (OSError, ValueError):
+            response = None
+        return response["exit"] if response and "exit" in response else 1
+
+
+class forkServer:
+    """Preloads clamity, boto3 and botocore service models then forks a child per command"""
+
+    def __init__(self, path: Optional[str] = None, idleTimeout: int = 3600) -> None:
+        self._path = path or socketPath()
+        self._idleTimeout = idleTimeout
+        self._started = time.time()
+        self._served = 0
+
+    def preload(self) -> None:
+        import importlib
+
+        for m in preloadModules:
+            importlib.import_module(m)
+        import clamity.aws.session as awsSession
+
+        awsSession.preloadServiceModels(preloadServices)
+
+    def _isStale(self) -> bool:
+        """True if any loaded clamity module has changed since the server started"""
+        for m in list(sys.modules.values()):
+            f = getattr(m, "__file__", None)
+            if f and m.__name__.startswith("clamity"):
+                try:
+                    if os.stat(f).st_mtime > self._started:
+                        return True
+                except OSError:
+                    return True
+        return False
+
+    def _status(self) -> dict:
+        return {
+            "ok": True,
+            "pid": os.getpid(),
+            "socket": self._path,
+            "uptime": int(time.time() - self._started),
+            "served": self._served,
+        }
+
+    def _runChild(self, conn: socket.socket, request: dict, fds: list) -> None:
+        """runs in the forked child. Never returns."""
+        exitCode = 1
+        try:
+            for sig in (signal.SIGCHLD, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT):
+                signal.signal(sig, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            for i, fd in enumerate(fds):
+                os.dup2(fd, i)
+                os.close(fd)
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+            sys.stderr = open(2, "w", buffering=1, closefd=False)
+            os.environ.clear()
+            os.environ.update(request["env"])
+            os.chdir(request["cwd"])
+            sys.argv = request["argv"]
+            sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+            _send(conn, {"pid": os.getpid()})
+            exitCode = self._runScript(sys.argv[0])
+        finally:
+            try:
+                atexit._run_exitfuncs()  # os._exit() skips them
+                sys.stdout.flush()
+                sys.stderr.flush()
+                _send(conn, {"exit": exitCode})
+            finally:
+                os._exit(exitCode)
+
+    def _runScript(self, script: str) -> int:
+        import runpy
+        import traceback
+
+        try:
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except KeyboardInterrupt:
+            return 130
+        except BaseException:
+            traceback.print_exc()
+            return 1
+        return 0
+
+    def _handle(self, conn: socket.socket) -> bool:
+        """handle one connection. Returns False when the server should stop."""
+        data, fds, _, _ = socket.recv_fds(conn, 65536, _maxFds)
+        try:
+            request = json.loads(_readLine(conn, data))
+        except ValueError:
+            request = {}
+        match request.get("op"):
+            case "exec":
+                if self._isStale():
+                    print("clamity modules changed, fork server exiting", file=sys.stderr)
+                    return False  # closing the connection makes the client run the command itself
+                self._served += 1
+                if os.fork() == 0:
+                    self._server.close()
+                    self._runChild(conn, request, fds)
+            case "status":
+                _send(conn, self._status())
+            case "stop":
+                _send(conn, {"ok": True})
+                return False
+            case _:
+                _send(conn, {"ok": False, "error": f"unknown request {request.get('op')}"})
+        for fd in fds:
+            os.close(fd)
+        return True
+
+    def serve(self) -> None:
+        """serve requests until stopped or idle (foreground)"""
+        if forkServerClient(self._path).isRunning:
+            return
+        self.preload()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        cDaemon.bindSocket(self._path, lambda: self._server.bind(self._path))
+        self._server.listen(16)
+        self._server.settimeout(self._idleTimeout)
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # children are reaped automatically
+        try:
+            while True:
+                try:
+                    conn, _ = self._server.accept()
+                except socket.timeout:
+                    break
+                with conn:
+                    conn.settimeout(None)
+                    if not self._handle(conn):
+                        break
+        finally:
+            self._server.close()
+            cDaemon.removeSocket(self._path)
+
+    def start(self, logFile: str = os.devnull) -> None:
+        """run the server in the background without waiting for it to preload"""
+        os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)  # logFile is alongside the socket
+        cDaemon.daemonize(self.serve, logFile)
+
+
+def _logFile() -> str:
+    return (
+        os.path.join(os.environ["CLAMITY_HOME"], "run", "py-forkserver.log")
+        if os.environ.get("CLAMITY_HOME")
+        else os.devnull
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ["start", "stop", "status", "run", "exec"]:
+        print(__doc__, file=sys.stderr)
+        exit(1)
+    if not socketPath():
+        print("CLAMITY_HOME is not set", file=sys.stderr)
+        exit(1)
+    client = forkServerClient()
+    match sys.argv[1]:
+        case "exec":
+            exitCode = client.execute(sys.argv[2:])
+            if exitCode is not None:
+                exit(exitCode)
+            if not client.isRunning:
+                forkServer().start(_logFile())  # warm it up for next time
+            sys.stdout.flush()
+            os.execv(sys.executable, [sys.executable] + sys.argv[2:])  # run it ourselves
+        case "start":
+            if not client.isRunning:
+                forkServer().start(_logFile())
+        case "stop":
+            client.request("stop")
+        case "status":
+            status = client.request("status")
+            print(json.dumps(status or {"ok": False, "error": "not running"}, indent=4))
+            exit(0 if status else 1)
+        case "run":
+            forkServer().serve()
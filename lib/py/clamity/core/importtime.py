@@ -0,0 +1,65 @@
+"""
+Import time budget check
+
+Commands that don't talk to AWS (help, 'secrets types', the secrets agent
+client, ...) should start quickly. This imports modules in a fresh interpreter
+with 'python -X importtime' and fails if any of them exceed the time budget or
+pull in heavy dependencies such as boto3.
+
+usage:
+
+    clam-py -m clamity.core.importtime [--budget-ms 50] [module ...]
+"""
+
+import re
+import sys
+import argparse
+import subprocess
+
+# modules which must stay light and the dependencies they must not import
+defaultModules = ["clamity", "clamity.core.options", "clamity.core.utils", "clamity.aws", "clamity.aws.agent"]
+heavyModules = ["boto3", "botocore", "deepdiff"]
+
+_importTimeLine = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importTimes(module: str) -> dict:
+    """import module in a new interpreter and return {module: cumulative microseconds} for all imported modules"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        m = _importTimeLine.match(line)
+        if m:
+            times[m.group(4)] = int(m.group(2))
+    return times
+
+
+def check(modules: list, budgetMs: float) -> bool:
+    """report import times for modules. False if any are over budget or import heavy dependencies."""
+    ok = True
+    for module in modules:
+        times = importTimes(module)
+        ms = times.get(module, 0) / 1000
+        heavy = [m for m in heavyModules if m in times]
+        status = "ok"
+        if ms > budgetMs:
+            status = "OVER BUDGET"
+            ok = False
+        if heavy:
+            status = f"IMPORTS {', '.join(heavy)}"
+            ok = False
+        print(f"{module:40s} {ms:8.1f}ms  {status}")
+        if status != "ok":
+            for m, us in sorted(times.items(), key=lambda x: x[1], reverse=True)[:5]:
+                print(f"    {m:36s} {us / 1000:8.1f}ms")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=50, help="max cumulative import time per module")
+    parser.add_argument("modules", nargs="*", default=defaultModules, help="modules to check")
+    args = parser.parse_args()
+    exit(0 if check(args.modules, args.budget_ms) else 1)
@@ -2,15 +2,19 @@
 core/options.py
 """
 
+import os
 import argparse
 from enum import Enum
 from typing import Self
+import clamity.core.telemetry as telemetry
 
 
 class outputFormat(Enum):
     JSON = 1
     TEXT = 2
     CSV = 3
+    TSV = 4
+    NDJSON = 5
 
 
 class Singleton(type):
@@ -51,14 +55,40 @@ class CmdOptions(metaclass=Singleton):
             "--output-format",
             type=str,
             default="text",
-            choices=["json", "text", "csv"],
-            help="json, text (default) or csv",
+            choices=["json", "text", "csv", "tsv", "ndjson"],
+            help="json, text (default), csv, tsv or ndjson (csv, tsv and ndjson rows are streamed unsorted)",
         )
+        self.add_argument("--compact", action="store_true", default=False, help="compact json output, streamed unsorted")
+        self.add_argument("--columns", type=str, help="comma separated list of columns to display (eg. name,id,region)")
         self.add_argument("--no-truncate", action="store_true", default=False, help="don't truncate column widths")
         self.add_argument("--no-header", action="store_true", default=False, help="don't display column headers")
+        self.add_argument(
+            "--auto-fit", action="store_true", default=False, help="size columns to fit the data (reads all rows first)"
+        )
+        self.add_argument(
+            "--no-sort", action="store_true", default=False, help="print resources as they're fetched (unsorted)"
+        )
+        self.add_argument(
+            "--stats",
+            action="store_true",
+            default=False,
+            help="report API calls, cache use and timings to stderr on exit (CLAMITY_TRACE=path records a trace)",
+        )
 
     def add_aws_args(self) -> None:
-        self.add_argument("--aws-region", type=str, help="AWS region (eg. us-east-1)")
+        self.add_argument(
+            "--aws-profile",
+            type=str,
+            help="AWS profile, comma separated list of profiles or 'all' (every profile in the AWS config).\n"
+            "Defaults to $AWS_PROFILE.",
+        )
+        self.add_argument(
+            "--aws-region", type=str, help="AWS region (eg. us-east-1), comma separated list of regions or 'all'"
+        )
+        self.add_argument(
+            "--refresh", action="store_true", default=False, help="ignore cached AWS data and refresh the cache"
+        )
+        self.add_argument("--no-cache", action="store_true", default=False, help="don't read or write cached AWS data")
 
     def add_args(self, arg_groups: list) -> None:
         for ag in arg_groups:
@@ -73,17 +103,16 @@ class CmdOptions(metaclass=Singleton):
 
     def parse(self, **kwargs):
         self.args = self._argparser.parse_args()
-        self.args.output_format = (
-            outputFormat.TEXT
-            if self.args.output_format == "text"
-            else outputFormat.JSON if self.args.output_format == "json" else outputFormat.CSV
-        )
+        self.args.output_format = outputFormat[self.args.output_format.upper()]
         if "help" in kwargs and getattr(self.args, kwargs["help"]) == "help":
             self.print_help()
             exit(1)
         self.args.truncate = not self.args.no_truncate
 
         self.args.header = not self.args.no_header
+        self.args.sort = not self.args.no_sort
+        self.args.columns = [c.strip() for c in self.args.columns.split(",") if c.strip()] if self.args.columns else []
+        telemetry.enable(stats=self.args.stats, tracePath=os.environ.get("CLAMITY_TRACE"))
         return self.args
 
     # def add_custom_argument(self, name, **kwargs):
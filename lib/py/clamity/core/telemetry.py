@@ -0,0 +1,179 @@
+"""
+Command telemetry
+
+Records what a command spends its time on: AWS API calls (service, operation,
+region, latency, retries, HTTP status and response size), cache hits and
+misses, credential resolution and rendering. Nothing is recorded unless
+telemetry is enabled, which happens when options are parsed with --stats or
+with CLAMITY_TRACE set.
+
+--stats prints a summary to stderr when the command exits. CLAMITY_TRACE=path
+writes every event to path when the command exits, in Chrome trace format
+(chrome://tracing, https://ui.perfetto.dev) if path ends in .json or as JSON
+lines otherwise.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+_lock = threading.Lock()
+_enabled = False
+_showStats = False
+_tracePath = None
+_start = time.perf_counter()
+_events = []  # chrome trace events
+_apiCalls = {}  # (service, operation, region) => counters
+_counters = {}  # name => count
+_spans = {}  # name => [count, total seconds]
+
+
+def enable(stats: bool = False, tracePath: Optional[str] = None) -> None:
+    """start recording. The summary and trace are written when the process exits."""
+    global _enabled, _showStats, _tracePath, _start
+    _showStats = _showStats or stats
+    _tracePath = _tracePath or tracePath
+    if not _enabled and (_showStats or _tracePath):
+        _enabled = True
+        _start = time.perf_counter()  # times are relative to parsing the command's options
+        atexit.register(_finish)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _us(t: float) -> int:
+    """perf_counter time => microseconds since start"""
+    return int((t - _start) * 1e6)
+
+
+def _event(name: str, cat: str, started: float, ended: Optional[float] = None, **args) -> None:
+    e = {"name": name, "cat": cat, "ts": _us(started), "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+    if ended is None:
+        e.update(ph="i", s="t")
+    else:
+        e.update(ph="X", dur=_us(ended) - e["ts"])
+    _events.append(e)
+
+
+def count(name: str, n: int = 1, **args) -> None:
+    """increment a counter (eg. cache.hit) and record it as an instant event"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+        _event(name, "counter", time.perf_counter(), **args)
+
+
+@contextmanager
+def span(name: str, cat: str = "clamity", **args):
+    """time a block of code (eg. rendering or resolving credentials)"""
+    if not _enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        with _lock:
+            s = _spans.setdefault(name, [0, 0.0])
+            s[0] += 1
+            s[1] += ended - started
+            _event(name, cat, started, ended, **args)
+
+
+def apiCall(
+    service: str,
+    operation: str,
+    region: str,
+    started: float,
+    status: Optional[int],
+    retries: int = 0,
+    size: int = 0,
+    error: Optional[str] = None,
+) -> None:
+    """record one AWS API call (which may have been retried)"""
+    ended = time.perf_counter()
+    with _lock:
+        c = _apiCalls.setdefault(
+            (service, operation, region), {"calls": 0, "retries": 0, "errors": 0, "bytes": 0, "total": 0.0, "max": 0.0}
+        )
+        c["calls"] += 1
+        c["retries"] += retries
+        c["errors"] += 1 if error or not status or status >= 300 else 0
+        c["bytes"] += size
+        c["total"] += ended - started
+        c["max"] = max(c["max"], ended - started)
+        _event(
+            f"{service}.{operation}",
+            "aws",
+            started,
+            ended,
+            region=region,
+            status=status,
+            retries=retries,
+            bytes=size,
+            **({"error": error} if error else {}),
+        )
+
+
+def summary() -> str:
+    """the --stats report"""
+    lines = []
+    if _apiCalls:
+        fmt = "{:<16} {:<32} {:<16} {:>6} {:>7} {:>6} {:>10} {:>9} {:>9} {:>9}"
+        lines.append(
+            fmt.format(
+                "Service", "Operation", "Region", "Calls", "Retries", "Errors", "Bytes", "Total ms", "Avg ms", "Max ms"
+            )
+        )
+        for (service, operation, region), c in sorted(_apiCalls.items(), key=lambda x: x[1]["total"], reverse=True):
+            lines.append(
+                fmt.format(
+                    service,
+                    operation,
+                    region or "",
+                    c["calls"],
+                    c["retries"],
+                    c["errors"],
+                    c["bytes"],
+                    f"{c['total'] * 1000:.1f}",
+                    f"{c['total'] * 1000 / c['calls']:.1f}",
+                    f"{c['max'] * 1000:.1f}",
+                )
+            )
+    for name, (n, total) in sorted(_spans.items()):
+        lines.append(f"{name}: {n} in {total * 1000:.1f}ms")
+    for name, n in sorted(_counters.items()):
+        lines.append(f"{name}: {n}")
+    lines.append(f"elapsed: {(time.perf_counter() - _start) * 1000:.1f}ms")
+    return "\n".join(lines)
+
+
+def writeTrace(path: str) -> None:
+    with _lock:
+        events = list(_events)
+    with open(path, "w") as f:
+        if path.endswith(".json"):
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        else:
+            for e in events:
+                f.write(json.dumps(e) + "\n")
+
+
+def _finish() -> None:
+    if _tracePath:
+        try:
+            writeTrace(_tracePath)
+        except OSError as e:
+            print(f"warn: could not write trace file {_tracePath}: {e}", file=sys.stderr)
+    if _showStats:
+        sys.stdout.flush()
+        print(summary(), file=sys.stderr)
@@ -3,25 +3,57 @@
 import sys
 from datetime import datetime, timezone, date
 import json
+from typing import Iterator
 
 
-def dumpJson(d: any, outputStream=sys.stdout) -> None:
-    """Dump a dictionary as JSON with sorted keys"""
+def jsonDateTimeHandler(x):
+    """json.dumps() default handler for datetimes (and anything else it can't serialize)"""
+    if isinstance(x, datetime) or isinstance(x, date):
+        return x.isoformat()
+    return str(type(x))
 
-    def jsonDateTimeHandler(x):
-        if isinstance(x, datetime) or isinstance(x, date):
-            return x.isoformat()
-        return str(type(x))
 
-    print(json.dumps(d, default=jsonDateTimeHandler, sort_keys=True, indent=4), file=outputStream)
+def dumpJson(d: any, outputStream=None) -> None:
+    """Dump a dictionary as JSON with sorted keys (to stdout by default)"""
+    print(json.dumps(d, default=jsonDateTimeHandler, sort_keys=True, indent=4), file=outputStream or sys.stdout)
 
 
-def dumpObj(o: any, **kwargs) -> None:
-    """Dump object properties as a JSON object (serializes)"""
-    d = {}
-    for p in dir(o):
-        if not p.startswith("_"):
-            d[p] = getattr(o, p)
+# reusable compact encoder for streaming output
+_compactEncoder = json.JSONEncoder(default=jsonDateTimeHandler, separators=(",", ":"))
+
+
+def dumpJsonStream(records: Iterator[any], outputStream=None, ndjson: bool = False) -> int:
+    """Write records as compact JSON as they're produced, either one per line (ndjson) or as
+    a single array (to stdout by default). Returns the number of records written."""
+    outputStream = outputStream or sys.stdout  # looked up per call; the fork server's children replace it
+    encode = _compactEncoder.encode
+    write = outputStream.write
+    numRecords = 0
+    if not ndjson:
+        write("[")
+    for r in records:
+        if ndjson:
+            write(encode(r) + "\n")
+        else:
+            write(("," if numRecords else "") + encode(r))
+        numRecords += 1
+    if not ndjson:
+        write("]\n")
+    outputStream.flush()
+    return numRecords
+
+
+def dumpObj(o: any, expand: list = [], **kwargs) -> None:
+    """Dump object properties as a JSON object (serializes). Objects with a serialize() method (AWS
+    resources) dump their declared fields, plus any expensive ones named in expand. Other objects dump
+    all their public attributes."""
+    if hasattr(o, "serialize"):
+        d = o.serialize(expand=expand)
+    else:
+        d = {}
+        for p in dir(o):
+            if not p.startswith("_"):
+                d[p] = getattr(o, p)
     dumpJson(d, **kwargs)
 
 
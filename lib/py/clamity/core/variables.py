@@ -48,7 +48,6 @@ VariableCache = {}
 
 class StructuredVariables:
     def __init__(self, varFiles: str | list, **kwargs) -> None:
-        global VariableCache
         self._vars = VariableCache
         self._kwargs = kwargs
         self.addFiles(varFiles)